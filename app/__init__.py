@@ -0,0 +1,116 @@
+import logging
+import os
+import weakref
+
+from flask import Flask
+from flask_compress import Compress
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+compress = Compress()
+
+# apps built in this process, their pools are dropped in forked children
+_apps = weakref.WeakSet()
+
+
+def _after_fork():
+    """
+    gunicorn --preload builds the app in the master and forks the workers from it, a
+    child must not reuse the master's sqlite connections or wait on its threads
+    """
+    if not _apps:
+        return
+
+    from .events import events
+    from .model import db
+    from .worker import recompute
+
+    recompute.reset_after_fork()
+    events.reset_after_fork()
+    for app in list(_apps):
+        with app.app_context():
+            for engine in db.engines.values():
+                # close=False leaves the inherited handles to the parent that still uses them
+                engine.dispose(close=False)
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_after_fork)
+
+
+def create_app(config=None):
+    """
+    builds the pongr app
+    :param config: 'development', 'production' or a config class, defaults to PONGR_ENV
+    """
+    from flask_admin import Admin
+    from flask_bootstrap import Bootstrap
+
+    from .admin import GameView, DoublesView, PlayerView, RatingsView
+    from .api import api
+    from .cache import cache
+    from .config import get_config
+    from .debug import debug
+    from .events import events
+    from .export import export
+    from .headtohead import head_to_head_missing, rebuild_head_to_head
+    from .importer import import_games_command
+    from .metrics import metrics
+    from .model import Game, DoublesGame, Player, Ratings, db, create_missing_indexes, add_missing_primary_keys
+    from .model import migrate_player_ids
+    from .ratings import history_missing
+    from .sweep import sweep_command
+    from .views import views
+    from .worker import recompute
+
+    config = get_config(config) if config is None or isinstance(config, str) else config
+
+    app = Flask(__name__, static_url_path='', static_folder=os.path.join(ROOT, 'static'),
+                template_folder=os.path.join(ROOT, 'templates'))
+    app.config.from_object(config)
+    config.init_app(app)
+
+    cache.init_app(app)
+    compress.init_app(app)
+    Bootstrap(app)
+
+    db.init_app(app)
+    recompute.init_app(app)
+    events.init_app(app)
+    metrics.init_app(app)
+    app.register_blueprint(views)
+    app.register_blueprint(api)
+    app.register_blueprint(export)
+    app.cli.add_command(import_games_command)
+    app.cli.add_command(sweep_command)
+    if app.config['DEBUG_VIEWS']:
+        app.register_blueprint(debug)
+
+    if not app.debug:
+        app.logger.addHandler(logging.StreamHandler())
+        app.logger.setLevel(logging.INFO)
+
+    with app.app_context():
+        db.create_all()
+        add_missing_primary_keys(db.engine)
+        # replays used to clean aliases themselves, head-to-head totals were keyed by them as entered
+        aliases_changed = migrate_player_ids(db.engine)
+        create_missing_indexes(db.engine)
+
+        # databases from before rating_history existed get it filled by one full replay
+        for kind, table in (('singles', 'game'), ('doubles', 'doubles_game')):
+            if history_missing(db.engine, kind, table):
+                recompute.submit(kind, full=True)
+
+        if aliases_changed or head_to_head_missing(db.engine):
+            with db.engine.begin() as conn:
+                rebuild_head_to_head(conn)
+
+        admin = Admin(app, name='pongr', template_mode='bootstrap3')
+        admin.add_view(GameView(Game, db.session))
+        admin.add_view(DoublesView(DoublesGame, db.session))
+        admin.add_view(PlayerView(Player, db.session))
+        admin.add_view(RatingsView(Ratings, db.session))
+
+    _apps.add(app)
+    return app
@@ -1,7 +1,12 @@
 from flask_admin.contrib.sqla import ModelView
 from flask import request, Response
+from sqlalchemy import inspect
 from werkzeug.exceptions import HTTPException
 
+from .headtohead import rebuild_head_to_head
+from .model import db
+from .worker import recompute
+
 
 class AuthModelView(ModelView):
     def is_accessible(self):
@@ -13,15 +18,48 @@ class AuthModelView(ModelView):
             ))
         return True
 
-class GameView(AuthModelView):
+
+class RatedGameView(AuthModelView):
+    """
+    edits to games replay ratings from the snapshot before the earliest point in
+    history the change touches, instead of from the first game
+    """
+    ratings_kind = None
+
+    def on_model_change(self, form, model, is_created):
+        previous = inspect(model).attrs.timestamp.history.deleted or []
+        timestamps = [t or 0 for t in list(previous) + [model.timestamp]]
+        model.ratings_since = (min(timestamps), model.id or 0)
+
+    def after_model_change(self, form, model, is_created):
+        recompute.submit(self.ratings_kind, since=model.ratings_since)
+
+    def after_model_delete(self, model):
+        recompute.submit(self.ratings_kind, since=(model.timestamp or 0, model.id))
+
+
+class GameView(RatedGameView):
     column_list = ('id', 'player_a', 'player_b', 'score_a', 'score_b', 'timestamp')
     can_create = True
+    ratings_kind = 'singles'
+
+    # admin edits can change any column of a game, so head-to-head totals are rebuilt rather than adjusted
+    def after_model_change(self, form, model, is_created):
+        super(GameView, self).after_model_change(form, model, is_created)
+        with db.engine.begin() as conn:
+            rebuild_head_to_head(conn)
+
+    def after_model_delete(self, model):
+        super(GameView, self).after_model_delete(model)
+        with db.engine.begin() as conn:
+            rebuild_head_to_head(conn)
 
 
-class DoublesView(AuthModelView):
+class DoublesView(RatedGameView):
     column_list = ('id', 'player_a_team_a', 'player_b_team_a',
     'player_a_team_b', 'player_b_team_b',  'score_team_a', 'score_team_b')
     can_create = True
+    ratings_kind = 'doubles'
 
 
 class PlayerView(AuthModelView):
@@ -0,0 +1,363 @@
+import base64
+import io
+import json
+import math
+
+from flask import Blueprint, abort, current_app, jsonify, request
+from sqlalchemy import text
+
+from .cache import ratings_win_matrix
+from .events import EventError, events
+from .headtohead import head_to_head_matrix, head_to_head_pair
+from .importer import GameImportError, import_games, read_games
+from .matchmaking import pairings, predict
+from .metrics import timed
+from .model import db
+from .plots import rating_distribution
+from .profile import player_profile
+from .state import rating_state
+from .utils import format_timestamps
+from .worker import recompute
+
+api = Blueprint('api', __name__, url_prefix='/api')
+
+GAME_LOG_COLUMNS = {
+    'game': ['id', 'player_a', 'score_a', 'player_b', 'score_b', 'timestamp'],
+    'doubles_game': ['id', 'player_a_team_a', 'player_b_team_a', 'score_team_a',
+                     'player_a_team_b', 'player_b_team_b', 'score_team_b', 'timestamp'],
+}
+
+MAX_PAGE_LENGTH = 500
+
+
+class QueryError(ValueError):
+    'raised with the list of query parameters that could not be parsed'
+
+    def __init__(self, errors):
+        super(QueryError, self).__init__('%d bad query parameter(s)' % len(errors))
+        self.errors = errors
+
+
+def query_number(args, name, default=None, convert=float):
+    'a finite number from the query args, default when it is absent'
+    value = args.get(name)
+    if value is None or value == '':
+        return default
+    try:
+        number = convert(value)
+    except ValueError:
+        number = None
+    if number is None or not math.isfinite(number):
+        raise QueryError(['%s must be a number, got %r' % (name, value)])
+    return number
+
+
+def encode_cursor(value, game_id):
+    return base64.urlsafe_b64encode(json.dumps([value, game_id]).encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor):
+    'the (sort value, game id) of a next_cursor, QueryError when it was not made by encode_cursor'
+    try:
+        value, game_id = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8'))
+    except (ValueError, TypeError):
+        raise QueryError(['cursor is not a next_cursor from this api'])
+    if not isinstance(game_id, int) or isinstance(value, (list, dict)):
+        raise QueryError(['cursor is not a next_cursor from this api'])
+    return value, game_id
+
+
+def _filters(table, args):
+    'where clauses and params for the player, date and search filters in args'
+    players = [c for c in GAME_LOG_COLUMNS[table] if c.startswith('player')]
+    clauses, params = ['deleted = 0'], {}
+
+    if args.get('player'):
+        clauses.append('(%s)' % ' or '.join('%s = :player' % c for c in players))
+        params['player'] = args['player']
+
+    if args.get('search[value]'):
+        clauses.append('(%s)' % ' or '.join('%s like :search' % c for c in players))
+        params['search'] = args['search[value]'] + '%'
+
+    if args.get('since'):
+        clauses.append('timestamp >= :since')
+        params['since'] = query_number(args, 'since')
+
+    if args.get('until'):
+        clauses.append('timestamp < :until')
+        params['until'] = query_number(args, 'until')
+
+    return clauses, params
+
+
+def _ordering(table, args):
+    'the sort column and direction, from the DataTables order[0] parameters or sort/dir'
+    columns = GAME_LOG_COLUMNS[table]
+
+    column = args.get('sort', 'id')
+    if 'order[0][column]' in args:
+        n = args['order[0][column]']
+        column = args.get('columns[%s][name]' % n) or args.get('columns[%s][data]' % n, column)
+
+    direction = args.get('order[0][dir]', args.get('dir', 'desc')).lower()
+
+    if column not in columns:
+        column = 'id'
+    if direction not in ('asc', 'desc'):
+        direction = 'desc'
+
+    return column, direction
+
+
+@timed('sql.game_log')
+def _sort_expression(column):
+    """
+    the sql to sort on column, with NULL as 0 or an empty string. a keyset cursor compares
+    with the sort value of the last row, and comparing with a NULL one matches nothing.
+    games without a timestamp sort at 0 like they do in replays
+    :return: (expression, the value NULL sorts as)
+    """
+    if column == 'id':
+        return column, None
+    return 'coalesce(%s, :sort_null)' % column, '' if column.startswith('player') else 0
+
+
+def game_log_page(con, table, args):
+    """
+    one page of the game log in the DataTables server-side processing format
+
+    pages are addressed with start/length like DataTables does, or with the
+    next_cursor of the previous page, which seeks on the (sort column, id)
+    index instead of counting past skipped rows
+    :raises QueryError: when a filter, paging parameter or cursor can't be parsed
+    """
+    columns = GAME_LOG_COLUMNS[table]
+    clauses, params = _filters(table, args)
+    column, direction = _ordering(table, args)
+
+    draw = query_number(args, 'draw', 0, int)
+    length = min(query_number(args, 'length', 25, int), MAX_PAGE_LENGTH)
+    if length == 0:
+        raise QueryError(['length must be 1 or more, or -1 for the longest page'])
+    if length < 0:
+        length = MAX_PAGE_LENGTH
+
+    sort, null = _sort_expression(column)
+    page_clauses, page_params = list(clauses), dict(params, length=length, sort_null=null)
+    offset = ''
+
+    if args.get('cursor'):
+        value, game_id = decode_cursor(args['cursor'])
+        op = '<' if direction == 'desc' else '>'
+        if column == 'id':
+            page_clauses.append('id %s :cursor_id' % op)
+        else:
+            page_clauses.append('({sort} {op} :cursor_value or ({sort} = :cursor_value and id {op} :cursor_id))'
+                                .format(sort=sort, op=op))
+        page_params.update(cursor_value=value, cursor_id=game_id)
+    else:
+        offset = ' offset :start'
+        page_params['start'] = query_number(args, 'start', 0, int)
+        if page_params['start'] < 0:
+            raise QueryError(['start must be 0 or more'])
+
+    s = 'select {cols} from {table} where {where} order by {sort} {dir}, id {dir} limit :length{offset}'.format(
+        cols=', '.join(columns), table=table, where=' and '.join(page_clauses),
+        sort=sort, dir=direction, offset=offset)
+
+    with con.connect() as conn:
+        total = conn.execute(text('select count(*) from %s where deleted = 0' % table)).scalar()
+        filtered = conn.execute(text('select count(*) from %s where %s' % (table, ' and '.join(clauses))),
+                                params).scalar()
+        data = [dict(zip(columns, row)) for row in conn.execute(text(s), page_params)]
+    times = format_timestamps([row['timestamp'] for row in data]).tolist()
+    for row, time in zip(data, times):
+        row['time'] = time
+
+    next_cursor = None
+    if data and len(data) == length:
+        last = data[-1][column]
+        next_cursor = encode_cursor(last if last is not None else null, data[-1]['id'])
+
+    return {'draw': draw, 'recordsTotal': total, 'recordsFiltered': filtered,
+            'data': data, 'next_cursor': next_cursor}
+
+
+def _game_log(table):
+    try:
+        return jsonify(game_log_page(db.engine, table, request.args))
+    except QueryError as e:
+        return jsonify({'errors': e.errors}), 400
+
+
+@api.route('/games', methods=['GET'])
+def games():
+    return _game_log('game')
+
+
+@api.route('/doubles_games', methods=['GET'])
+def doubles_games():
+    return _game_log('doubles_game')
+
+
+@api.route('/players/<alias>', methods=['GET'])
+def player(alias):
+    profile = player_profile(db.engine, alias)
+    if profile is None:
+        abort(404)
+    return jsonify(profile)
+
+
+@api.route('/head_to_head', methods=['GET'])
+def head_to_head():
+    'the singles head-to-head matrix, ?players=a,b,c picks and orders the players'
+    players = request.args.get('players')
+    return jsonify(head_to_head_matrix(db.engine, players.split(',') if players else None))
+
+
+@api.route('/head_to_head/<player>/<opponent>', methods=['GET'])
+def head_to_head_record(player, opponent):
+    return jsonify(head_to_head_pair(db.engine, player, opponent))
+
+
+def _ratings_payload(name, payload):
+    """
+    a json payload built from the current rating state, etagged by its version so
+    a browser revalidating an unchanged chart gets an empty 304
+    """
+    state = rating_state(db.engine)
+    etag = '%s-%d' % (name, state.version)
+
+    if etag in request.if_none_match:
+        response = current_app.response_class(status=304)
+    else:
+        response = jsonify(dict(payload(state), version=state.version))
+
+    response.set_etag(etag)
+    response.cache_control.no_cache = True
+
+    return response
+
+
+@api.route('/ratings/distribution', methods=['GET'])
+def distribution():
+    'singles alias, name, mu and sigma arrays, highest rated first'
+    return _ratings_payload('distribution', rating_distribution)
+
+
+@api.route('/ratings/win_matrix', methods=['GET'])
+def win_matrix():
+    'predicted win probabilities and observed head-to-head counts, players in ascending rating order'
+    return _ratings_payload('win-matrix', lambda state: ratings_win_matrix(db.engine, state))
+
+
+def _teams(match):
+    'a [player_a, player_b] singles or [[a1, a2], [b1, b2]] doubles match as two lists of aliases'
+    if not isinstance(match, (list, tuple)) or len(match) != 2:
+        return None
+    teams = [[side] if isinstance(side, str) else side for side in match]
+    if not all(isinstance(team, list) and team and all(isinstance(a, str) for a in team) for team in teams):
+        return None
+    return teams
+
+
+@api.route('/predict', methods=['POST'])
+def predict_matches():
+    """
+    win probability and match quality for a batch of candidate matches in one call,
+    {"matches": [["a", "b"], ...]} for singles or [[["a1", "a2"], ["b1", "b2"]], ...]
+    for doubles, rated from doubles_ratings
+    """
+    matches = (request.get_json(silent=True) or {}).get('matches')
+    if not isinstance(matches, list) or not matches:
+        return jsonify({'errors': ['expected a json body with a non-empty "matches" list']}), 400
+
+    teams = [_teams(m) for m in matches]
+    errors = ['match %d: expected two players or two teams' % n for n, t in enumerate(teams) if t is None]
+    if not errors and len(set(len(team) for t in teams for team in t)) != 1:
+        errors.append('every team in a batch has to be the same size')
+    if errors:
+        return jsonify({'errors': errors}), 400
+
+    kind = 'singles' if len(teams[0][0]) == 1 else 'doubles'
+    state = rating_state(db.engine)
+    table = getattr(state, kind)
+
+    mu_a, sigma_a = table.lookup([t[0] for t in teams])
+    mu_b, sigma_b = table.lookup([t[1] for t in teams])
+    with timed('matchmaking.predict'):
+        probability, quality = predict(mu_a, sigma_a, mu_b, sigma_b)
+
+    return jsonify({'version': state.version, 'kind': kind,
+                    'matches': [{'team_a': a, 'team_b': b, 'win_probability': p, 'quality': q}
+                                for (a, b), p, q in zip(teams, probability.tolist(), quality.tolist())]})
+
+
+@api.route('/matchmaking', methods=['GET', 'POST'])
+def matchmaking():
+    """
+    balanced singles pairings for one round among the present players, given as
+    ?players=a,b,c or a json body {"players": [...]}
+    """
+    if request.method == 'POST':
+        players = (request.get_json(silent=True) or {}).get('players')
+    else:
+        players = request.args.get('players', '').split(',')
+
+    if not isinstance(players, list) or not all(isinstance(p, str) for p in players):
+        return jsonify({'errors': ['expected a list of player aliases']}), 400
+    players = [p for p in players if p]
+    if len(players) < 2:
+        return jsonify({'errors': ['at least two players are needed to make a round']}), 400
+
+    state = rating_state(db.engine)
+    with timed('matchmaking.pairings'):
+        round_ = pairings(state.singles, players)
+
+    return jsonify(dict(round_, version=state.version))
+
+
+@api.route('/events', methods=['POST'])
+def post_events():
+    """
+    scoreboard events, one json object or a list of them. each needs a unique
+    event_id, a match_id, type 'point' or 'final', player_a, player_b, score_a,
+    score_b and optionally an epoch timestamp; a final event records the game
+    """
+    body = request.get_json(silent=True)
+    try:
+        report = events.submit(body if isinstance(body, list) else [body])
+    except EventError as e:
+        return jsonify({'errors': e.errors}), 400
+
+    if 'error' in report:
+        return jsonify(report), 500
+    return jsonify(report), 202
+
+
+@api.route('/import', methods=['POST'])
+def import_():
+    """
+    bulk game import, a csv or json file upload in the 'file' field or a json
+    list in the request body, ?doubles=1 imports into doubles_game
+    """
+    table = 'doubles_game' if request.args.get('doubles') else 'game'
+
+    try:
+        if 'file' in request.files:
+            upload = request.files['file']
+            fmt = 'json' if upload.filename.lower().endswith('.json') else 'csv'
+            df = read_games(upload.stream, table, fmt)
+        else:
+            df = read_games(io.BytesIO(request.get_data()), table, 'json' if request.is_json else 'csv')
+        report = import_games(db.engine, table, df)
+    except GameImportError as e:
+        return jsonify({'imported': 0, 'errors': e.errors}), 400
+
+    return jsonify(report)
+
+
+@api.route('/status', methods=['GET'])
+def status():
+    return jsonify(recompute.status())
@@ -0,0 +1,78 @@
+import threading
+from collections import OrderedDict
+
+from flask_caching import Cache
+from flask_caching.backends.base import BaseCache
+
+from .plots import win_matrix
+
+# the backend comes from app.config, CACHE_TYPE 'app.cache.lru' (in-process),
+# 'FileSystemCache' (with CACHE_DIR) or 'RedisCache' (with CACHE_REDIS_URL, any redis-compatible server)
+cache = Cache()
+
+
+class LRUCache(BaseCache):
+    'in-process cache that evicts the least recently used key once threshold keys are stored'
+
+    def __init__(self, threshold=16, default_timeout=0, **kwargs):
+        super(LRUCache, self).__init__(default_timeout, **kwargs)
+        self._threshold = threshold
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            if key not in self._cache:
+                return None
+            value = self._cache.pop(key)
+            self._cache[key] = value
+            return value
+
+    def set(self, key, value, timeout=None):
+        with self._lock:
+            self._cache.pop(key, None)
+            self._cache[key] = value
+            while len(self._cache) > self._threshold:
+                self._cache.popitem(last=False)
+        return True
+
+    def has(self, key):
+        with self._lock:
+            return key in self._cache
+
+    def add(self, key, value, timeout=None):
+        with self._lock:
+            if key in self._cache:
+                return False
+        return self.set(key, value, timeout)
+
+    def delete(self, key):
+        with self._lock:
+            return self._cache.pop(key, None) is not None
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+        return True
+
+    @classmethod
+    def factory(cls, app, config, args, kwargs):
+        kwargs.update(dict(threshold=config.get('CACHE_THRESHOLD', 16)))
+        return cls(*args, **kwargs)
+
+
+def lru(app, config, args, kwargs):
+    'Flask-Caching factory for CACHE_TYPE = "app.cache.lru", "app.cache.LRUCache" works as well'
+    return LRUCache.factory(app, config, args, kwargs)
+
+
+def ratings_win_matrix(con, state):
+    'the cached /api/ratings/win_matrix payload for a state.RatingState'
+    key = 'ratings-win-matrix/%d' % state.version
+    payload = cache.get(key)
+
+    if payload is None:
+        payload = win_matrix(con, state)
+        cache.set(key, payload)
+
+    return payload
@@ -0,0 +1,73 @@
+import os
+import tempfile
+
+
+def _env(name, default=None, cast=str):
+    value = os.environ.get(name)
+    return default if value is None or value == '' else cast(value)
+
+
+class Config(object):
+    'settings shared by every profile, each one can be overridden with a PONGR_* environment variable'
+    SQLALCHEMY_DATABASE_URI = _env('PONGR_DATABASE_URI', 'sqlite:///pong.db')
+    SQLALCHEMY_TRACK_MODIFICATIONS = False
+    SECRET_KEY = _env('PONGR_SECRET_KEY', 'supersecret')
+
+    DISPLAY_TIMEZONE = _env('PONGR_TIMEZONE', 'America/New_York')
+
+    # exports gzip their own streams, buffering a streamed body to compress it would defeat streaming
+    COMPRESS_STREAMS = False
+
+    RECOMPUTE_ASYNC = True
+    # a failed recompute is queued again and the background thread waits this long before retrying it
+    RECOMPUTE_RETRY_SECONDS = _env('PONGR_RECOMPUTE_RETRY', 5., float)
+
+    # scoreboard events posted within this window share one commit, posts wait for it up to the ack timeout
+    EVENTS_GROUP_COMMIT_SECONDS = _env('PONGR_EVENTS_GROUP_COMMIT', 0.01, float)
+    EVENTS_ACK_TIMEOUT = _env('PONGR_EVENTS_ACK_TIMEOUT', 5., float)
+
+    # cached pages are keyed by the ratings version stored in the database, so any
+    # backend shared by the workers is invalidated for all of them by one republish
+    CACHE_TYPE = _env('PONGR_CACHE_TYPE', 'app.cache.lru')
+    CACHE_DIR = _env('PONGR_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'pongr-cache'))
+    CACHE_REDIS_URL = _env('PONGR_CACHE_REDIS_URL')
+    CACHE_THRESHOLD = _env('PONGR_CACHE_THRESHOLD', 16, int)
+    CACHE_DEFAULT_TIMEOUT = _env('PONGR_CACHE_TIMEOUT', 24 * 3600, int)
+
+    DEBUG_VIEWS = bool(_env('PONGR_DEBUG'))
+
+    # per-stage timings in a Server-Timing response header, and cProfile dumps of a sample of requests
+    METRICS_SERVER_TIMING = bool(_env('PONGR_SERVER_TIMING'))
+    PROFILE_SAMPLE_RATE = _env('PONGR_PROFILE_SAMPLE_RATE', 0., float)
+    PROFILE_DIR = _env('PONGR_PROFILE_DIR', 'profiles')
+
+    @classmethod
+    def init_app(cls, app):
+        if not app.config['SQLALCHEMY_DATABASE_URI'].startswith('sqlite'):
+            # sqlite connections are cheap and file-locked, pool sizing only applies to server databases.
+            # Flask-SQLAlchemy 3 passes SQLALCHEMY_ENGINE_OPTIONS to create_engine, options set there win
+            pool = {'pool_size': _env('PONGR_POOL_SIZE', 5, int),
+                    'max_overflow': _env('PONGR_MAX_OVERFLOW', 10, int),
+                    'pool_recycle': _env('PONGR_POOL_RECYCLE', 3600, int)}
+            app.config['SQLALCHEMY_ENGINE_OPTIONS'] = dict(pool, **app.config.get('SQLALCHEMY_ENGINE_OPTIONS', {}))
+
+
+class DevelopmentConfig(Config):
+    DEBUG = True
+    DEBUG_VIEWS = True
+
+
+class ProductionConfig(Config):
+    'several worker processes serve the app, so the page cache has to live outside any one of them'
+    CACHE_TYPE = _env('PONGR_CACHE_TYPE', 'RedisCache' if _env('PONGR_CACHE_REDIS_URL') else 'FileSystemCache')
+
+
+configs = {
+    'development': DevelopmentConfig,
+    'production': ProductionConfig,
+}
+
+
+def get_config(name=None):
+    'the config class for name, or for PONGR_ENV, defaulting to production'
+    return configs[name or _env('PONGR_ENV', 'production')]
@@ -0,0 +1,24 @@
+from flask import Blueprint, render_template
+
+# development-only views, registered by the development config or when PONGR_DEBUG is set
+debug = Blueprint('debug', __name__)
+
+
+@debug.route('/test', methods=['GET'])
+def test_chart():
+    import pandas as pd
+    from pandas_highcharts.core import serialize
+    from pandas.compat import StringIO
+    dat = """ts;A;B;C
+    2015-01-01 00:00:00;27451873;29956800;113
+    2015-01-01 01:00:00;20259882;17906600;76
+    2015-01-01 02:00:00;11592256;12311600;48
+    2015-01-01 03:00:00;11795562;11750100;50
+    2015-01-01 04:00:00;9396718;10203900;43
+    2015-01-01 05:00:00;14902826;14341100;53"""
+    df = pd.read_csv(StringIO(dat), sep=';', index_col='ts', parse_dates=['ts'])
+
+    # Basic line plot
+    chart = serialize(df, render_to='my-chart', output_type='json')
+
+    return render_template('test_chart.html', chart=chart)
@@ -0,0 +1,281 @@
+import math
+import threading
+import time
+
+from sqlalchemy import text
+
+from .headtohead import add_games
+from .model import Game, MatchEvent, db
+from .utils import normalize_alias
+from .worker import recompute
+
+EVENT_TYPES = ('point', 'final')
+EVENT_COLUMNS = ['event_id', 'match_id', 'type', 'player_a', 'player_b', 'score_a', 'score_b',
+                 'timestamp', 'received_at']
+
+MAX_EVENTS = 1000
+MAX_ERRORS = 100
+
+# how far ahead of the server clock a device timestamp may be, anything later is a wrong clock
+# or milliseconds and would put every following game behind it in replay order
+MAX_CLOCK_SKEW = 300.
+
+# a newly registered player is picked up on the first event naming them, at most this often
+PLAYER_RELOAD_SECONDS = 1.
+
+
+class EventError(ValueError):
+    'raised with the list of problems found in a batch of events, none of which are written'
+
+    def __init__(self, errors):
+        super(EventError, self).__init__('%d problem(s) in events' % len(errors))
+        self.errors = errors
+
+
+class EventWriter(object):
+    """
+    appends scoreboard events to match_events with group commits: posts queue
+    their events and wait while one thread writes everything queued in the last
+    EVENTS_GROUP_COMMIT_SECONDS in a single transaction. final events become game
+    rows in the same transaction and are rated by the recompute worker afterwards,
+    incrementally when the game is the newest and by a replay from it when a
+    device sent it late with an earlier timestamp
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self._cond = threading.Condition()
+        self._queue = []
+        self._thread = None
+        self._players = {}
+        self._players_loaded = 0
+        self._players_lock = threading.Lock()
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('EVENTS_GROUP_COMMIT_SECONDS', 0.01)
+        app.config.setdefault('EVENTS_ACK_TIMEOUT', 5.)
+        app.extensions['events'] = self
+        self.app = app
+
+    def reset_after_fork(self):
+        'a forked child has no writer thread, and the events it inherited are acknowledged by the parent'
+        self._cond = threading.Condition()
+        self._queue = []
+        self._thread = None
+        self._players_lock = threading.Lock()
+
+    def player_ids(self, con, aliases):
+        'alias -> player_id for the aliases that are registered, from a cached copy of the player table'
+        missing = [a for a in aliases if a not in self._players]
+        if missing and time.time() - self._players_loaded > PLAYER_RELOAD_SECONDS:
+            with self._players_lock:
+                with con.connect() as conn:
+                    self._players = dict(conn.execute(text('select alias, player_id from player')).fetchall())
+                self._players_loaded = time.time()
+
+        players = self._players
+        return {a: players[a] for a in aliases if a in players}
+
+    def validate(self, con, events):
+        """
+        normalizes a list of event dicts and checks them against the cached players
+        :return: (events as column dicts, list of error strings)
+        """
+        if not events:
+            return [], ['no events']
+        if len(events) > MAX_EVENTS:
+            return [], ['at most %d events per request' % MAX_EVENTS]
+
+        received = time.time()
+        rows, errors = [], []
+        for n, event in enumerate(events):
+            if not isinstance(event, dict):
+                errors.append('event %d: expected an object' % n)
+                continue
+
+            row = {c: event.get(c) for c in EVENT_COLUMNS}
+            row['player_a'] = normalize_alias(row['player_a'])
+            row['player_b'] = normalize_alias(row['player_b'])
+            row['timestamp'] = row['timestamp'] if row['timestamp'] is not None else received
+            row['received_at'] = received
+            rows.append((n, row))
+
+            if not row['event_id'] or not isinstance(row['event_id'], str):
+                errors.append('event %d: event_id is required' % n)
+            if not row['match_id'] or not isinstance(row['match_id'], str):
+                errors.append('event %d: match_id is required' % n)
+            if row['type'] not in EVENT_TYPES:
+                errors.append('event %d: type must be one of %s' % (n, ', '.join(EVENT_TYPES)))
+            if not all(isinstance(row[c], str) and row[c] for c in ('player_a', 'player_b')):
+                errors.append('event %d: player_a and player_b are required' % n)
+            elif row['player_a'] == row['player_b']:
+                errors.append('event %d: a player appears more than once' % n)
+            if not all(isinstance(row[c], int) and not isinstance(row[c], bool) and row[c] >= 0
+                       for c in ('score_a', 'score_b')):
+                errors.append('event %d: scores must be whole numbers >= 0' % n)
+            if not isinstance(row['timestamp'], (int, float)) or isinstance(row['timestamp'], bool):
+                errors.append('event %d: timestamp must be epoch seconds' % n)
+            elif (isinstance(row['timestamp'], float) and not math.isfinite(row['timestamp'])
+                  or not 0 <= row['timestamp'] <= received + MAX_CLOCK_SKEW):
+                errors.append('event %d: timestamp must be epoch seconds, not in the future' % n)
+            if len(errors) >= MAX_ERRORS:
+                return [], errors
+
+        aliases = set(r[c] for _, r in rows for c in ('player_a', 'player_b') if isinstance(r[c], str))
+        known = self.player_ids(con, aliases)
+        for n, row in rows:
+            unknown = [row[c] for c in ('player_a', 'player_b') if isinstance(row[c], str) and row[c] not in known]
+            if unknown:
+                errors.append('event %d: unknown player(s) %s' % (n, ', '.join(repr(a) for a in unknown)))
+            row['player_a_id'], row['player_b_id'] = known.get(row['player_a']), known.get(row['player_b'])
+            if len(errors) >= MAX_ERRORS:
+                break
+
+        return [row for _, row in rows], errors
+
+    def submit(self, events):
+        """
+        validates and queues events, waiting until they are committed
+        :raises EventError: when any event is invalid, nothing is queued
+        :return: report dict with the events written, duplicates ignored and
+            games recorded, or queued when the commit outlasted EVENTS_ACK_TIMEOUT
+        """
+        rows, errors = self.validate(db.engine, events)
+        if errors:
+            raise EventError(errors)
+
+        ticket = {'rows': rows, 'done': threading.Event(), 'report': None}
+
+        # with RECOMPUTE_ASYNC off (the cli, benchmarks) events are written and rated before returning
+        if not self.app.config['RECOMPUTE_ASYNC']:
+            self._write([ticket])
+            return ticket['report']
+
+        with self._cond:
+            self._queue.append(ticket)
+            self._ensure_thread()
+            self._cond.notify()
+
+        if not ticket['done'].wait(self.app.config['EVENTS_ACK_TIMEOUT']):
+            return {'queued': len(rows)}
+        return ticket['report']
+
+    def _ensure_thread(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._loop, name='match-events')
+            self._thread.daemon = True
+            self._thread.start()
+
+    def _loop(self):
+        while True:
+            with self._cond:
+                while not self._queue:
+                    self._cond.wait()
+
+            # posts arriving while the group window is open share its commit
+            time.sleep(self.app.config['EVENTS_GROUP_COMMIT_SECONDS'])
+
+            with self._cond:
+                tickets, self._queue = self._queue, []
+            with self.app.app_context():
+                self._write(tickets)
+
+    def _write(self, tickets):
+        try:
+            with db.engine.begin() as conn:
+                folded = [self._write_events(conn, ticket) for ticket in tickets]
+        except Exception as e:
+            self.app.logger.exception('writing match events failed')
+            for ticket in tickets:
+                ticket['report'] = {'error': repr(e)}
+                ticket['done'].set()
+            return
+
+        for ticket, games in zip(tickets, folded):
+            for game_id, since in games:
+                if since is None:
+                    recompute.submit('singles', game_id=game_id)
+                else:
+                    recompute.submit('singles', since=since)
+            ticket['done'].set()
+
+    def _write_events(self, conn, ticket):
+        """
+        writes one ticket's events in the group's transaction
+        :return: (game id, replay point or None) of each game it recorded
+        """
+        rows = ticket['rows']
+        params = {'e%d' % n: r['event_id'] for n, r in enumerate(rows)}
+        s = 'select event_id from match_events where event_id in ({params})'.format(
+            params=', '.join(':' + p for p in params))
+        seen = set(r[0] for r in conn.execute(text(s), params))
+
+        new = []
+        for row in rows:
+            if row['event_id'] not in seen:
+                seen.add(row['event_id'])
+                new.append(row)
+
+        insert = _insert_ignore(conn).format(cols=', '.join(EVENT_COLUMNS),
+                                             params=', '.join(':' + c for c in EVENT_COLUMNS))
+        points = [r for r in new if r['type'] == 'point']
+        if points:
+            conn.execute(text(insert), [{c: r[c] for c in EVENT_COLUMNS} for r in points])
+
+        games = []
+        for row in (r for r in new if r['type'] == 'final'):
+            # another process may have taken the same event_id since it was looked up
+            if conn.execute(text(insert), {c: row[c] for c in EVENT_COLUMNS}).rowcount != 1:
+                continue
+            game = self._fold(conn, row)
+            if game is not None:
+                games.append(game)
+
+        ticket['report'] = {'written': len(new), 'duplicates': len(rows) - len(new),
+                            'games': [game_id for game_id, _ in games]}
+        return games
+
+    def _fold(self, conn, row):
+        """
+        records a final event as a game, once per match
+        :return: (game id, None) when the game is the newest in replay order, else
+            (game id, (timestamp, game id)) to replay from it, None when already folded
+        """
+        folded = conn.execute(text('select 1 from match_events where match_id = :match_id and game_id is not null'),
+                              {'match_id': row['match_id']}).fetchone()
+        if folded is not None:
+            return None
+
+        result = conn.execute(Game.__table__.insert().values(
+            player_a=row['player_a'], player_b=row['player_b'], player_a_id=row['player_a_id'],
+            player_b_id=row['player_b_id'], score_a=row['score_a'], score_b=row['score_b'],
+            timestamp=row['timestamp'], deleted=0))
+        game_id = result.inserted_primary_key[0]
+
+        add_games(conn, [(row['player_a'], row['player_b'], row['score_a'], row['score_b'], row['timestamp'])])
+        conn.execute(MatchEvent.__table__.update().where(MatchEvent.event_id == row['event_id'])
+                     .values(game_id=game_id))
+
+        # the new id is the highest, so the game is last in replay order unless a later timestamp exists.
+        # games without one replay at 0, before any device timestamp, so the timestamp index can answer this
+        later = conn.execute(text('select 1 from game where deleted = 0 and timestamp > :ts limit 1'),
+                             {'ts': row['timestamp']}).fetchone()
+        return game_id, ((row['timestamp'], game_id) if later is not None else None)
+
+
+def _insert_ignore(conn):
+    'an insert into match_events that skips an event_id already stored'
+    if conn.dialect.name == 'sqlite':
+        return 'insert or ignore into match_events ({cols}) values ({params})'
+    if conn.dialect.name == 'postgresql':
+        return 'insert into match_events ({cols}) values ({params}) on conflict (event_id) do nothing'
+    if conn.dialect.name == 'mysql':
+        return 'insert ignore into match_events ({cols}) values ({params})'
+    # elsewhere the unique constraint rejects a duplicate that slipped past the lookup
+    return 'insert into match_events ({cols}) values ({params})'
+
+
+events = EventWriter()
@@ -0,0 +1,137 @@
+import csv
+import io
+import json
+import zlib
+
+from flask import Blueprint, Response, jsonify, request, stream_with_context
+from sqlalchemy import text
+
+from .api import GAME_LOG_COLUMNS, QueryError, query_number
+from .model import db
+from .utils import format_timestamps
+
+export = Blueprint('export', __name__, url_prefix='/export')
+
+RATING_TABLES = {
+    'singles': ('ratings', 'alias'),
+    'doubles': ('doubles_ratings', 'alias'),
+    'team': ('team_doubles_ratings', 'team'),
+}
+
+CHUNK_SIZE = 1000
+
+
+def stream_query(con, s, params=None, chunk_size=CHUNK_SIZE):
+    """
+    yields (column names, rows) chunks from a server-side cursor, so only
+    chunk_size rows are held in memory at a time
+    """
+    with con.connect() as conn:
+        result = conn.execution_options(stream_results=True).execute(text(s), params or {})
+        columns = list(result.keys())
+        while True:
+            rows = result.fetchmany(chunk_size)
+            if not rows:
+                break
+            yield columns, rows
+
+
+def _games_query(table, args):
+    'games in replay order, after the since= unix timestamp when given, QueryError when it is not a number'
+    s = 'select {cols} from {table} where deleted = 0'.format(cols=', '.join(GAME_LOG_COLUMNS[table]), table=table)
+    params = {}
+    if args.get('since'):
+        s += ' and timestamp >= :since'
+        params['since'] = query_number(args, 'since')
+    return s + ' order by coalesce(timestamp, 0), id', params
+
+
+def _with_time(columns, rows):
+    'rows as dicts with the formatted local time next to the raw timestamp'
+    records = [dict(zip(columns, row)) for row in rows]
+    times = format_timestamps([r['timestamp'] for r in records]).tolist()
+    for record, time in zip(records, times):
+        record['time'] = time
+    return records
+
+
+def csv_chunks(chunks, header):
+    'one csv text chunk per row chunk, header first'
+    buf = io.StringIO()
+    writer = csv.DictWriter(buf, header, extrasaction='ignore')
+    writer.writeheader()
+    for records in chunks:
+        writer.writerows(records)
+        yield buf.getvalue()
+        buf.seek(0)
+        buf.truncate()
+    yield buf.getvalue()
+
+
+def ndjson_chunks(chunks):
+    for records in chunks:
+        yield ''.join(json.dumps(r) + '\n' for r in records)
+
+
+def gzip_chunks(chunks):
+    'gzips a text stream incrementally'
+    z = zlib.compressobj(6, zlib.DEFLATED, zlib.MAX_WBITS | 16)
+    for chunk in chunks:
+        data = z.compress(chunk.encode('utf-8'))
+        if data:
+            yield data
+    yield z.flush()
+
+
+def streamed(chunks, mimetype, filename):
+    """
+    streaming response, gzipped in the generator when the client accepts it
+
+    Flask-Compress would buffer the whole body to compress a streamed response
+    (COMPRESS_STREAMS is off in app.config), and it leaves responses that already
+    carry a Content-Encoding alone
+    """
+    headers = {'Content-Disposition': 'attachment; filename=%s' % filename, 'Vary': 'Accept-Encoding'}
+    if 'gzip' in request.accept_encodings:
+        chunks = gzip_chunks(chunks)
+        headers['Content-Encoding'] = 'gzip'
+    return Response(stream_with_context(chunks), mimetype=mimetype, headers=headers)
+
+
+def _game_table():
+    return 'doubles_game' if request.args.get('doubles') else 'game'
+
+
+@export.route('/games.csv', methods=['GET'])
+def games_csv():
+    table = _game_table()
+    try:
+        s, params = _games_query(table, request.args)
+    except QueryError as e:
+        return jsonify({'errors': e.errors}), 400
+    chunks = (_with_time(columns, rows) for columns, rows in stream_query(db.engine, s, params))
+    return streamed(csv_chunks(chunks, GAME_LOG_COLUMNS[table] + ['time']), 'text/csv', '%s.csv' % table)
+
+
+@export.route('/games.ndjson', methods=['GET'])
+def games_ndjson():
+    table = _game_table()
+    try:
+        s, params = _games_query(table, request.args)
+    except QueryError as e:
+        return jsonify({'errors': e.errors}), 400
+    chunks = (_with_time(columns, rows) for columns, rows in stream_query(db.engine, s, params))
+    return streamed(ndjson_chunks(chunks), 'application/x-ndjson', '%s.ndjson' % table)
+
+
+@export.route('/ratings.csv', methods=['GET'])
+def ratings_csv():
+    table, key = RATING_TABLES.get(request.args.get('kind'), RATING_TABLES['singles'])
+    chunks = stream_query(db.engine, 'select * from %s order by rating desc, %s' % (table, key))
+
+    def records():
+        for columns, rows in chunks:
+            yield [dict(zip(columns, row)) for row in rows]
+
+    header = [c.name for c in db.metadata.tables[table].columns]
+    return streamed(csv_chunks(records(), header), 'text/csv', '%s.csv' % table)
@@ -0,0 +1,156 @@
+from sqlalchemy import text
+
+COUNT_COLUMNS = ['games', 'low_wins', 'high_wins', 'draws', 'low_points', 'high_points']
+COLUMNS = ['player_low', 'player_high', 'last_played'] + COUNT_COLUMNS
+
+
+def pair_key(player_a, player_b):
+    'head-to-head rows are keyed by the sorted pair of aliases'
+    return tuple(sorted((player_a, player_b)))
+
+
+def _pair_deltas(games, sign=1):
+    """
+    sums (player_a, player_b, score_a, score_b, timestamp) games into one delta
+    per pair, counts are multiplied by sign
+    """
+    deltas = {}
+    for player_a, player_b, score_a, score_b, timestamp in games:
+        if player_a == player_b:
+            continue
+        low, high = pair_key(player_a, player_b)
+        if low != player_a:
+            score_a, score_b = score_b, score_a
+
+        delta = deltas.setdefault((low, high), dict({c: 0 for c in COUNT_COLUMNS},
+                                                    player_low=low, player_high=high, last_played=None))
+        delta['games'] += sign
+        delta['low_wins'] += sign * (score_a > score_b)
+        delta['high_wins'] += sign * (score_a < score_b)
+        delta['draws'] += sign * (score_a == score_b)
+        delta['low_points'] += sign * score_a
+        delta['high_points'] += sign * score_b
+        if timestamp is not None:
+            delta['last_played'] = max(delta['last_played'] or timestamp, timestamp)
+
+    return list(deltas.values())
+
+
+def add_games(conn, games):
+    """
+    adds games to the head_to_head table in the caller's transaction, one
+    upsert per pair
+    :param games: iterable of (player_a, player_b, score_a, score_b, timestamp)
+    """
+    update = ('update head_to_head set {sets}, last_played = case when :last_played > coalesce(last_played, 0) '
+              'then :last_played else last_played end '
+              'where player_low = :player_low and player_high = :player_high'
+              ).format(sets=', '.join('{c} = {c} + :{c}'.format(c=c) for c in COUNT_COLUMNS))
+    insert = 'insert into head_to_head ({cols}) values ({params})'.format(
+        cols=', '.join(COLUMNS), params=', '.join(':' + c for c in COLUMNS))
+
+    for delta in _pair_deltas(games):
+        if conn.execute(text(update), delta).rowcount == 0:
+            conn.execute(text(insert), delta)
+
+
+def remove_games(conn, games):
+    """
+    takes games back out of the head_to_head table after they were marked deleted,
+    the pairs' last_played is reread from the remaining games
+    """
+    update = ('update head_to_head set {sets} where player_low = :player_low and player_high = :player_high'
+              ).format(sets=', '.join('{c} = {c} + :{c}'.format(c=c) for c in COUNT_COLUMNS))
+    last_played = '''
+    update head_to_head set last_played = (
+        select max(timestamp) from game where deleted = 0 and (
+            (player_a = :player_low and player_b = :player_high) or
+            (player_a = :player_high and player_b = :player_low)))
+    where player_low = :player_low and player_high = :player_high
+    '''
+
+    for delta in _pair_deltas(games, sign=-1):
+        conn.execute(text(update), delta)
+        conn.execute(text(last_played), delta)
+
+    conn.execute(text('delete from head_to_head where games <= 0'))
+
+
+def rebuild_head_to_head(conn):
+    'recomputes the whole table from game with one scan, for backfills and arbitrary edits'
+    s = '''
+    insert into head_to_head (player_low, player_high, games, low_wins, high_wins, draws,
+                              low_points, high_points, last_played)
+    select
+        low, high, count(*),
+        sum(case when low_score > high_score then 1 else 0 end),
+        sum(case when low_score < high_score then 1 else 0 end),
+        sum(case when low_score = high_score then 1 else 0 end),
+        sum(low_score), sum(high_score), max(timestamp)
+    from (
+        select player_a as low, player_b as high, score_a as low_score, score_b as high_score, timestamp
+        from game where deleted = 0 and player_a < player_b
+        union all
+        select player_b, player_a, score_b, score_a, timestamp
+        from game where deleted = 0 and player_b < player_a
+    ) as pairs
+    group by low, high
+    '''
+    conn.execute(text('delete from head_to_head'))
+    conn.execute(text(s))
+
+
+def head_to_head_missing(con):
+    'true when games exist but the head_to_head table has not been filled yet'
+    s = 'select exists (select 1 from game where deleted = 0) and not exists (select 1 from head_to_head)'
+    with con.connect() as conn:
+        return bool(conn.execute(text(s)).scalar())
+
+
+def _oriented(row, player):
+    'a head_to_head row as a record seen from player\'s side'
+    record = dict(zip(COLUMNS, row))
+    mine, theirs = ('low', 'high') if record['player_low'] == player else ('high', 'low')
+    return {'player': player, 'opponent': record['player_' + theirs], 'games': record['games'],
+            'won': record[mine + '_wins'], 'lost': record[theirs + '_wins'], 'drawn': record['draws'],
+            'points_for': record[mine + '_points'], 'points_against': record[theirs + '_points'],
+            'last_played': record['last_played']}
+
+
+def head_to_head_pair(con, player, opponent):
+    'the record of player against opponent with one primary key lookup, all zeros when they have not played'
+    low, high = pair_key(player, opponent)
+    s = 'select {cols} from head_to_head where player_low = :low and player_high = :high'.format(
+        cols=', '.join(COLUMNS))
+    with con.connect() as conn:
+        row = conn.execute(text(s), {'low': low, 'high': high}).fetchone()
+
+    if row is None:
+        row = [low, high, None] + [0] * len(COUNT_COLUMNS)
+    return _oriented(row, player)
+
+
+def head_to_head_matrix(con, players=None):
+    """
+    win and game counts for every pair at once
+    :param players: aliases in matrix order, defaults to everyone with a head-to-head row
+    :return: dict with players, and wins and games lists where wins[i][j] is the
+        number of games players[i] won against players[j]
+    """
+    s = 'select player_low, player_high, games, low_wins, high_wins from head_to_head'
+    with con.connect() as conn:
+        rows = conn.execute(text(s)).fetchall()
+
+    if players is None:
+        players = sorted(set(r[0] for r in rows) | set(r[1] for r in rows))
+    index = {p: n for n, p in enumerate(players)}
+
+    wins = [[0] * len(players) for _ in players]
+    games = [[0] * len(players) for _ in players]
+    for low, high, n_games, low_wins, high_wins in rows:
+        if low in index and high in index:
+            i, j = index[low], index[high]
+            wins[i][j], wins[j][i] = low_wins, high_wins
+            games[i][j] = games[j][i] = n_games
+
+    return {'players': players, 'wins': wins, 'games': games}
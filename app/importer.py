@@ -0,0 +1,203 @@
+import io
+import json
+import time
+
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import text
+
+from .headtohead import add_games
+from .model import PLAYER_COLUMNS, db
+from .utils import display_timezone
+from .worker import recompute
+
+IMPORT_COLUMNS = {
+    'game': ['player_a', 'score_a', 'player_b', 'score_b', 'timestamp'],
+    'doubles_game': ['player_a_team_a', 'player_b_team_a', 'score_team_a',
+                     'player_a_team_b', 'player_b_team_b', 'score_team_b', 'timestamp'],
+}
+
+RATINGS_KIND = {'game': 'singles', 'doubles_game': 'doubles'}
+
+BATCH_SIZE = 1000
+MAX_ERRORS = 100
+
+# no real game gets near this, it keeps garbage scores from overflowing the integer columns
+MAX_SCORE = 1000
+
+
+class GameImportError(ValueError):
+    'raised with the list of problems found when an import file fails validation'
+
+    def __init__(self, errors):
+        super(GameImportError, self).__init__('%d problem(s) in import' % len(errors))
+        self.errors = errors
+
+
+def read_games(f, table, fmt='csv'):
+    """
+    reads games from a csv file or a json list of objects into a dataframe
+    :param f: file object, text or bytes
+    :param fmt: 'csv' or 'json'
+    :raises GameImportError: when the file can't be parsed
+    """
+    import pandas as pd
+
+    players = [c for c in IMPORT_COLUMNS[table] if c.startswith('player')]
+    raw = f.read()
+    try:
+        if isinstance(raw, bytes):
+            raw = raw.decode('utf-8-sig')
+
+        if fmt == 'json':
+            games = json.loads(raw)
+            if not isinstance(games, list) or not all(isinstance(g, dict) for g in games):
+                raise GameImportError(['expected a json list of game objects'])
+            df = pd.DataFrame(games)
+        else:
+            df = pd.read_csv(io.StringIO(raw), dtype=dict((c, str) for c in players), skipinitialspace=True)
+    except GameImportError:
+        raise
+    except ValueError as e:
+        # json, unicode and pandas parser errors are all ValueErrors
+        raise GameImportError(['unreadable %s: %s' % (fmt, e)])
+
+    df.columns = [str(c).strip() for c in df.columns]
+    return df
+
+
+def _timestamps(values, tz):
+    'unix timestamps from epoch numbers or date strings, naive dates are read in tz'
+    import pandas as pd
+
+    numeric = pd.to_numeric(values, errors='coerce')
+    if numeric.notnull().all():
+        return numeric.astype(float)
+
+    dates = pd.to_datetime(values, errors='coerce')
+    if dates.dt.tz is None:
+        dates = dates.dt.tz_localize(tz, ambiguous='NaT', nonexistent='NaT')
+    epoch = (dates.dt.tz_convert('UTC').dt.tz_localize(None) - pd.Timestamp(0)).dt.total_seconds()
+    return numeric.where(numeric.notnull(), epoch)
+
+
+def validate_games(con, table, df):
+    """
+    normalizes an import dataframe to the table's columns and checks every alias
+    against the player table with one query, resolving it to its player id
+    :return: (rows as dicts, list of error strings)
+    """
+    import pandas as pd
+
+    columns = IMPORT_COLUMNS[table]
+    players = [c for c in columns if c.startswith('player')]
+    scores = [c for c in columns if c.startswith('score')]
+
+    missing = [c for c in players + scores if c not in df.columns]
+    if missing:
+        return [], ['missing column(s): %s' % ', '.join(missing)]
+
+    df = df.copy()
+    if 'timestamp' not in df.columns:
+        df['timestamp'] = None
+    df = df[columns]
+
+    for c in players:
+        df[c] = df[c].where(df[c].notnull(), '').astype(str).str.replace(r'\s+', '', regex=True)
+    for c in scores:
+        df[c] = pd.to_numeric(df[c], errors='coerce')
+
+    has_timestamp = df['timestamp'].notnull()
+    df['timestamp'] = _timestamps(df['timestamp'].where(has_timestamp, 0), display_timezone())
+    df.loc[~has_timestamp, 'timestamp'] = time.time()
+
+    with con.connect() as conn:
+        known = dict(conn.execute(text('select alias, player_id from player')).fetchall())
+
+    errors = []
+    for n, row in enumerate(df.itertuples(index=False), 1):
+        row = row._asdict()
+        unknown = [row[c] for c in players if row[c] not in known]
+        if unknown:
+            errors.append('row %d: unknown player(s) %s' % (n, ', '.join(repr(a) for a in unknown)))
+        if len(set(row[c] for c in players)) < len(players):
+            errors.append('row %d: a player appears more than once' % n)
+        # the range check comes first so int() never sees inf
+        if any(pd.isnull(row[c]) or not 0 <= row[c] <= MAX_SCORE or row[c] != int(row[c]) for c in scores):
+            errors.append('row %d: scores must be whole numbers from 0 to %d' % (n, MAX_SCORE))
+        if pd.isnull(row['timestamp']):
+            errors.append('row %d: unreadable timestamp' % n)
+        if len(errors) >= MAX_ERRORS:
+            break
+
+    for c in scores:
+        df[c] = df[c].where(df[c].between(0, MAX_SCORE), 0).astype(int)
+    for c in players:
+        df[c + '_id'] = df[c].map(known)
+
+    # object dtype hands the driver python ints and floats rather than numpy scalars
+    return df.astype(object).to_dict('records'), errors
+
+
+def import_games(con, table, df):
+    """
+    validates and inserts games in batched transactions, then queues one ratings
+    recompute from the earliest imported game
+    :return: report dict with row count and throughput
+    """
+    start = time.time()
+    rows, errors = validate_games(con, table, df)
+    if errors:
+        raise GameImportError(errors)
+
+    columns = IMPORT_COLUMNS[table] + [c + '_id' for c in PLAYER_COLUMNS[table]]
+    s = 'insert into {table} ({cols}, deleted) values ({params}, 0)'.format(
+        table=table, cols=', '.join(columns), params=', '.join(':' + c for c in columns))
+
+    for i in range(0, len(rows), BATCH_SIZE):
+        batch = rows[i:i + BATCH_SIZE]
+        with con.begin() as conn:
+            conn.execute(text(s), batch)
+            if table == 'game':
+                add_games(conn, [(r['player_a'], r['player_b'], r['score_a'], r['score_b'], r['timestamp'])
+                                 for r in batch])
+    inserted = time.time()
+
+    if rows:
+        # imported games get ids above every existing game, so (earliest timestamp, 0) precedes all of them
+        recompute.submit(RATINGS_KIND[table], since=(min(r['timestamp'] for r in rows), 0))
+    finished = time.time()
+
+    return {'table': table,
+            'rows': len(rows),
+            'insert_seconds': inserted - start,
+            'rows_per_second': len(rows) / (inserted - start) if rows else 0,
+            'recompute_seconds': finished - inserted,
+            'recompute_async': recompute.app.config['RECOMPUTE_ASYNC']}
+
+
+@click.command('import-games')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--doubles', is_flag=True, help='import into doubles_game instead of game')
+@click.option('--format', 'fmt', type=click.Choice(['csv', 'json']), default=None,
+              help='file format, guessed from the extension by default')
+@with_appcontext
+def import_games_command(path, doubles, fmt):
+    'bulk import historical games from a csv or json file'
+    table = 'doubles_game' if doubles else 'game'
+    fmt = fmt or ('json' if path.lower().endswith('.json') else 'csv')
+
+    # the process exits when the command returns, so the recompute runs inline
+    recompute.app.config['RECOMPUTE_ASYNC'] = False
+
+    try:
+        with open(path, 'rb') as f:
+            df = read_games(f, table, fmt)
+        report = import_games(db.engine, table, df)
+    except GameImportError as e:
+        for error in e.errors:
+            click.echo(error, err=True)
+        raise click.ClickException('nothing imported')
+
+    click.echo('imported {rows} games into {table} in {insert_seconds:.2f}s ({rows_per_second:.0f} games/s), '
+               'ratings recomputed in {recompute_seconds:.2f}s'.format(**report))
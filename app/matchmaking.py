@@ -0,0 +1,73 @@
+import numpy as np
+from trueskill import global_env
+
+from .ratings import win_probability_matrix
+
+
+def predict(mu_a, sigma_a, mu_b, sigma_b, beta=None):
+    """
+    win probability of team a and TrueSkill match quality for a batch of matches at once
+    :param mu_a: (n_matches, team_size) array of team a rating means, likewise the others
+    :param beta: per-game performance deviation, defaults to the global environment's
+    :return: (win probability, quality) arrays of n_matches
+    """
+    from scipy.special import ndtr
+
+    beta = global_env().beta if beta is None else beta
+    size = mu_a.shape[1] + mu_b.shape[1]
+
+    delta_mu = mu_a.sum(axis=1) - mu_b.sum(axis=1)
+    c2 = size * beta ** 2 + (sigma_a ** 2).sum(axis=1) + (sigma_b ** 2).sum(axis=1)
+
+    probability = ndtr(delta_mu / np.sqrt(c2))
+    quality = np.sqrt(size * beta ** 2 / c2) * np.exp(-delta_mu ** 2 / (2 * c2))
+
+    return probability, quality
+
+
+def quality_matrix(mu, sigma, beta=None):
+    'TrueSkill 1v1 match quality for every pair of players, entry [i, j] for i playing j'
+    beta = global_env().beta if beta is None else beta
+
+    delta_mu = mu[:, np.newaxis] - mu[np.newaxis, :]
+    c2 = 2 * beta ** 2 + sigma[:, np.newaxis] ** 2 + sigma[np.newaxis, :] ** 2
+
+    return np.sqrt(2 * beta ** 2 / c2) * np.exp(-delta_mu ** 2 / (2 * c2))
+
+
+def pairings(table, players, beta=None):
+    """
+    proposes one round of 1v1 games among the present players, greedily pairing
+    the closest remaining match by TrueSkill quality until everyone has a game
+    :param table: state.RatingTable of the singles ratings
+    :param players: list of present aliases
+    :return: dict with the pairs, each with its win probability and quality, the
+        unpaired player of an odd count as bye, and the mean quality of the round
+    """
+    beta = global_env().beta if beta is None else beta
+    players = list(dict.fromkeys(players))
+
+    mu, sigma = table.lookup([players])
+    mu, sigma = mu[0], sigma[0]
+    quality = quality_matrix(mu, sigma, beta)
+    probability = win_probability_matrix(mu, sigma, beta=beta)
+
+    i, j = np.triu_indices(len(players), k=1)
+    order = np.argsort(-quality[i, j], kind='mergesort')
+
+    paired = np.zeros(len(players), dtype=bool)
+    pairs = []
+    for a, b in zip(i[order].tolist(), j[order].tolist()):
+        if paired[a] or paired[b]:
+            continue
+        paired[a] = paired[b] = True
+        pairs.append({'player_a': players[a], 'player_b': players[b],
+                      'win_probability': float(probability[a, b]), 'quality': float(quality[a, b])})
+        if len(pairs) == len(players) // 2:
+            break
+
+    bye = [p for p, done in zip(players, paired.tolist()) if not done]
+
+    return {'pairs': pairs,
+            'bye': bye[0] if bye else None,
+            'quality': float(np.mean([p['quality'] for p in pairs])) if pairs else None}
@@ -0,0 +1,171 @@
+import cProfile
+import os
+import random
+import threading
+import time
+from bisect import bisect_left
+from functools import wraps
+
+from flask import Response, g, has_request_context, request
+
+# prometheus' default buckets, in seconds
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram(object):
+    'cumulative-bucket histogram per label set, in the shape prometheus expects'
+
+    def __init__(self, name, help, labels, buckets=BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(l, '') for l in self.labels)
+        with self._lock:
+            counts, total = self._series.get(key, ([0] * (len(self.buckets) + 1), 0.))
+            counts[bisect_left(self.buckets, value)] += 1
+            self._series[key] = (counts, total + value)
+
+    def expose(self):
+        'the histogram in the prometheus text exposition format'
+        lines = ['# HELP %s %s' % (self.name, self.help), '# TYPE %s histogram' % self.name]
+
+        with self._lock:
+            series = sorted((k, (list(c), t)) for k, (c, t) in self._series.items())
+
+        for key, (counts, total) in series:
+            labels = ['%s="%s"' % (l, _escape(v)) for l, v in zip(self.labels, key)]
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += count
+                le = bound if bound == '+Inf' else repr(float(bound))
+                lines.append('%s_bucket{%s} %d' % (self.name, ','.join(labels + ['le="%s"' % le]), cumulative))
+            lines.append('%s_sum{%s} %r' % (self.name, ','.join(labels), total))
+            lines.append('%s_count{%s} %d' % (self.name, ','.join(labels), cumulative))
+
+        return '\n'.join(lines)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+REQUEST_SECONDS = Histogram('pongr_request_duration_seconds', 'Time spent handling requests.',
+                            ['route', 'method', 'status'])
+STAGE_SECONDS = Histogram('pongr_stage_duration_seconds', 'Time spent in instrumented stages, per route.',
+                          ['route', 'stage'])
+
+
+def _route():
+    if has_request_context():
+        return request.url_rule.rule if request.url_rule is not None else 'unmatched'
+    return 'background'
+
+
+class timed(object):
+    """
+    times a stage as a context manager or decorator, recording it in the stage
+    histogram under the current route and in the request's Server-Timing header
+
+        with timed('sql.game_log'):
+            ...
+
+        @timed('ratings.replay')
+        def replay_ratings(...):
+    """
+
+    def __init__(self, stage):
+        self.stage = stage
+
+    def __enter__(self):
+        self._start = time.time()
+        return self
+
+    def __exit__(self, *exc):
+        elapsed = time.time() - self._start
+        STAGE_SECONDS.observe(elapsed, route=_route(), stage=self.stage)
+        if has_request_context():
+            g.setdefault('stage_timings', []).append((self.stage, elapsed))
+        return False
+
+    def __call__(self, f):
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            with timed(self.stage):
+                return f(*args, **kwargs)
+        return wrapper
+
+
+class Metrics(object):
+    """
+    request timing, the /metrics endpoint, the optional Server-Timing header
+    (METRICS_SERVER_TIMING) and cProfile dumps of a PROFILE_SAMPLE_RATE fraction
+    of requests into PROFILE_DIR
+    """
+
+    def __init__(self, app=None):
+        # cProfile can only profile one request at a time
+        self._profiling = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('METRICS_SERVER_TIMING', False)
+        app.config.setdefault('PROFILE_SAMPLE_RATE', 0.)
+        app.config.setdefault('PROFILE_DIR', 'profiles')
+
+        app.before_request(self._before)
+        app.after_request(self._after)
+        app.teardown_request(self._teardown)
+        app.add_url_rule('/metrics', 'metrics', self.expose)
+        self.app = app
+
+    def _before(self):
+        g.request_start = time.time()
+
+        rate = self.app.config['PROFILE_SAMPLE_RATE']
+        if rate and random.random() < rate and self._profiling.acquire(False):
+            g.profile = cProfile.Profile()
+            g.profile.enable()
+
+    def _after(self, response):
+        profile = g.pop('profile', None)
+        if profile is not None:
+            profile.disable()
+            self._profiling.release()
+            self._dump(profile)
+
+        elapsed = time.time() - g.get('request_start', time.time())
+        REQUEST_SECONDS.observe(elapsed, route=_route(), method=request.method, status=response.status_code)
+
+        if self.app.config['METRICS_SERVER_TIMING']:
+            timings = g.get('stage_timings', []) + [('total', elapsed)]
+            response.headers['Server-Timing'] = ', '.join('%s;dur=%.1f' % (stage, 1000 * seconds)
+                                                          for stage, seconds in timings)
+
+        return response
+
+    def _teardown(self, exc):
+        'a view that raised skips after_request, the profiler still has to be released'
+        profile = g.pop('profile', None)
+        if profile is not None:
+            profile.disable()
+            self._profiling.release()
+
+    def _dump(self, profile):
+        directory = self.app.config['PROFILE_DIR']
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        name = '%d-%s.prof' % (time.time() * 1000, (request.endpoint or 'unmatched').replace('.', '-'))
+        profile.dump_stats(os.path.join(directory, name))
+
+    def expose(self):
+        body = '\n'.join(h.expose() for h in (REQUEST_SECONDS, STAGE_SECONDS)) + '\n'
+        return Response(body, mimetype='text/plain; version=0.0.4')
+
+
+metrics = Metrics()
@@ -1,29 +1,74 @@
+import logging
+import sqlite3
+
 from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy import Column, Integer, Text, create_engine, MetaData, Float, Boolean
+from sqlalchemy import Column, Integer, Text, create_engine, MetaData, Float, Boolean, LargeBinary, Index, inspect
+from sqlalchemy import ForeignKey
+from sqlalchemy import event, text
+from sqlalchemy.engine import Engine
+
+from .utils import normalize_alias
 
 db = SQLAlchemy()
 
+log = logging.getLogger(__name__)
+
+SQLITE_BUSY_TIMEOUT = 10000
+
+
+@event.listens_for(Engine, 'connect')
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    """
+    WAL lets readers keep going while a game or ratings are written, and
+    busy_timeout makes a second writer wait for the lock instead of failing
+    with 'database is locked'
+    """
+    if isinstance(dbapi_connection, sqlite3.Connection):
+        cursor = dbapi_connection.cursor()
+        cursor.execute('PRAGMA journal_mode=WAL')
+        cursor.execute('PRAGMA synchronous=NORMAL')
+        cursor.execute('PRAGMA busy_timeout=%d' % SQLITE_BUSY_TIMEOUT)
+        cursor.close()
+
+
+# the alias columns of each game table, every one has an integer <column>_id
+# foreign key to player alongside it
+PLAYER_COLUMNS = {
+    'game': ('player_a', 'player_b'),
+    'doubles_game': ('player_a_team_a', 'player_b_team_a', 'player_a_team_b', 'player_b_team_b'),
+}
+
+
+def _player_id():
+    return Column(Integer, ForeignKey('player.player_id'), unique=False, index=True)
+
 
 class Game(db.Model):
     id = Column(Integer, primary_key=True)
-    player_a = Column(Text, unique=False)
-    player_b = Column(Text, unique=False)
+    player_a = Column(Text, unique=False, index=True)
+    player_b = Column(Text, unique=False, index=True)
+    player_a_id = _player_id()
+    player_b_id = _player_id()
     score_a = Column(Integer, unique=False)
     score_b = Column(Integer, unique=False)
-    timestamp = Column(Integer, unique=False)
-    deleted = Column(Boolean, unique=False)
+    timestamp = Column(Integer, unique=False, index=True)
+    deleted = Column(Boolean, unique=False, index=True)
 
 
 class DoublesGame(db.Model):
     id = Column(Integer, primary_key=True)
-    player_a_team_a = Column(Text, unique=False)
-    player_b_team_a = Column(Text, unique=False)
-    player_a_team_b = Column(Text, unique=False)
-    player_b_team_b = Column(Text, unique=False)
+    player_a_team_a = Column(Text, unique=False, index=True)
+    player_b_team_a = Column(Text, unique=False, index=True)
+    player_a_team_b = Column(Text, unique=False, index=True)
+    player_b_team_b = Column(Text, unique=False, index=True)
+    player_a_team_a_id = _player_id()
+    player_b_team_a_id = _player_id()
+    player_a_team_b_id = _player_id()
+    player_b_team_b_id = _player_id()
     score_team_a = Column(Integer, unique=False)
     score_team_b = Column(Integer, unique=False)
-    timestamp = Column(Integer, unique=False)
-    deleted = Column(Boolean, unique=False)
+    timestamp = Column(Integer, unique=False, index=True)
+    deleted = Column(Boolean, unique=False, index=True)
 
 
 class Player(db.Model):
@@ -33,10 +78,217 @@ class Player(db.Model):
     alias = Column(Text, unique=True)
 
 
+@event.listens_for(Player, 'before_insert')
+@event.listens_for(Player, 'before_update')
+def normalize_player(mapper, connection, target):
+    target.alias = normalize_alias(target.alias)
+
+
+@event.listens_for(Game, 'before_insert')
+@event.listens_for(Game, 'before_update')
+@event.listens_for(DoublesGame, 'before_insert')
+@event.listens_for(DoublesGame, 'before_update')
+def normalize_game_players(mapper, connection, target):
+    'aliases are normalized once as a game is written and resolved to player ids, so replays use them as stored'
+    for column in PLAYER_COLUMNS[target.__tablename__]:
+        alias = normalize_alias(getattr(target, column))
+        setattr(target, column, alias)
+        setattr(target, column + '_id', connection.execute(
+            text('select player_id from player where alias = :alias'), {'alias': alias}).scalar())
+
+
 class Ratings(db.Model):
     alias = Column(Text, primary_key=True)
     rating = Column(Float, unique=False)
     sigma = Column(Float, unique=False)
     tau = Column(Float, unique=False)
     pi = Column(Float, unique=False)
-    trueskill = Column(Float, unique=False)
\ No newline at end of file
+    trueskill = Column(Float, unique=False)
+
+
+class DoublesRatings(db.Model):
+    alias = Column(Text, primary_key=True)
+    rating = Column(Float, unique=False)
+    sigma = Column(Float, unique=False)
+    tau = Column(Float, unique=False)
+    pi = Column(Float, unique=False)
+    trueskill = Column(Float, unique=False)
+
+
+class TeamDoublesRatings(db.Model):
+    team = Column(Text, primary_key=True)
+    rating = Column(Float, unique=False)
+    sigma = Column(Float, unique=False)
+    tau = Column(Float, unique=False)
+    pi = Column(Float, unique=False)
+    trueskill = Column(Float, unique=False)
+    player1 = Column(Text, unique=False)
+    player2 = Column(Text, unique=False)
+
+class RatingSnapshot(db.Model):
+    id = Column(Integer, primary_key=True)
+    kind = Column(Text, unique=False)
+    position = Column(Integer, unique=False)
+    game_id = Column(Integer, unique=False)
+    timestamp = Column(Integer, unique=False)
+    ratings = Column(LargeBinary, unique=False)
+
+    __table_args__ = (Index('ix_rating_snapshot_kind_point', 'kind', 'timestamp', 'game_id'),)
+
+
+class RatingHistory(db.Model):
+    'the rating of each player (or team) after each game they played'
+    id = Column(Integer, primary_key=True)
+    kind = Column(Text, unique=False)
+    game_id = Column(Integer, unique=False)
+    timestamp = Column(Float, unique=False)
+    alias = Column(Text, unique=False)
+    mu = Column(Float, unique=False)
+    sigma = Column(Float, unique=False)
+
+    __table_args__ = (Index('ix_rating_history_kind_alias_point', 'kind', 'alias', 'timestamp', 'game_id'),
+                      Index('ix_rating_history_kind_point', 'kind', 'timestamp', 'game_id'))
+
+
+class HeadToHead(db.Model):
+    'running totals for each pair of singles players, the alphabetically lower alias first'
+    player_low = Column(Text, primary_key=True)
+    player_high = Column(Text, primary_key=True)
+    games = Column(Integer, unique=False)
+    low_wins = Column(Integer, unique=False)
+    high_wins = Column(Integer, unique=False)
+    draws = Column(Integer, unique=False)
+    low_points = Column(Integer, unique=False)
+    high_points = Column(Integer, unique=False)
+    last_played = Column(Float, unique=False)
+
+
+class MatchEvent(db.Model):
+    """
+    the write-ahead log of scoreboard updates, event_id is supplied by the device
+    so a retried post is ignored, a final event is folded into the game it records
+    """
+    __tablename__ = 'match_events'
+    id = Column(Integer, primary_key=True)
+    event_id = Column(Text, unique=True)
+    match_id = Column(Text, unique=False, index=True)
+    type = Column(Text, unique=False)
+    player_a = Column(Text, unique=False)
+    player_b = Column(Text, unique=False)
+    score_a = Column(Integer, unique=False)
+    score_b = Column(Integer, unique=False)
+    timestamp = Column(Float, unique=False)
+    received_at = Column(Float, unique=False)
+    game_id = Column(Integer, ForeignKey('game.id'), unique=False, index=True)
+
+
+class RatingsVersion(db.Model):
+    id = Column(Integer, primary_key=True)
+    version = Column(Integer, unique=False)
+    timestamp = Column(Float, unique=False)
+
+
+def create_missing_indexes(engine):
+    'db.create_all only indexes tables it creates, this adds indexes declared since to existing tables'
+    inspector = inspect(engine)
+    tables = set(inspector.get_table_names())
+
+    for table in db.metadata.sorted_tables:
+        if table.name not in tables:
+            continue
+
+        existing = set(ix['name'] for ix in inspector.get_indexes(table.name))
+        for index in table.indexes:
+            if index.name not in existing:
+                index.create(bind=engine)
+
+
+def add_missing_primary_keys(engine):
+    """
+    ratings tables written by the old to_sql(if_exists='replace') publication lost
+    their primary key, this rebuilds them from the models and copies the rows over
+    """
+    for model in (Ratings, DoublesRatings, TeamDoublesRatings):
+        table = model.__table__
+        inspector = inspect(engine)
+
+        if table.name not in inspector.get_table_names():
+            continue
+        if inspector.get_pk_constraint(table.name).get('constrained_columns'):
+            continue
+
+        legacy = table.name + '_legacy'
+        existing = set(c['name'] for c in inspector.get_columns(table.name))
+        columns = ', '.join(c.name for c in table.columns if c.name in existing)
+
+        with engine.begin() as conn:
+            conn.execute(text('alter table {t} rename to {l}'.format(t=table.name, l=legacy)))
+            table.create(bind=conn)
+            conn.execute(text('insert into {t} ({cols}) select {cols} from {l}'
+                              .format(t=table.name, l=legacy, cols=columns)))
+            conn.execute(text('drop table %s' % legacy))
+
+
+def assign_player_ids(conn, table):
+    'fills the player id columns of games written without them from their aliases'
+    for column in PLAYER_COLUMNS[table]:
+        conn.execute(text('update {t} set {c}_id = (select player_id from player where player.alias = {t}.{c}) '
+                          'where {c}_id is null and {c} is not null'.format(t=table, c=column)))
+
+
+def _normalize_column(conn, table, column, keep=()):
+    """
+    rewrites the values of column that are not normalized, returns how many distinct values changed
+    :param keep: aliases left as they are, players who kept theirs because the cleaned one was taken
+    """
+    values = [r[0] for r in conn.execute(text('select distinct {c} from {t} where {c} is not null'
+                                               .format(t=table, c=column)))]
+    changed = [(v, normalize_alias(v)) for v in values if normalize_alias(v) != v and v not in keep]
+
+    for old, new in changed:
+        conn.execute(text('update {t} set {c} = :new where {c} = :old'.format(t=table, c=column)),
+                     {'old': old, 'new': new})
+
+    return len(changed)
+
+
+def migrate_player_ids(engine):
+    """
+    normalizes aliases written before they were cleaned on insert, and adds and
+    fills the player id columns of game tables created before they existed
+    :return: number of alias values rewritten, anything keyed by the old ones needs rebuilding
+    """
+    inspector = inspect(engine)
+    tables = set(inspector.get_table_names())
+
+    with engine.begin() as conn:
+        aliases = set(r[0] for r in conn.execute(text('select alias from player')))
+        # a player whose cleaned alias is already taken keeps theirs rather than merging two players,
+        # and so do their games
+        changed, kept = 0, set()
+        for old in sorted(aliases):
+            new = normalize_alias(old)
+            if new == old:
+                continue
+            if new in aliases:
+                kept.add(old)
+                log.warning('player %r keeps their alias, %r is already registered', old, new)
+                continue
+            conn.execute(text('update player set alias = :new where alias = :old'), {'old': old, 'new': new})
+            aliases.add(new)
+            changed += 1
+
+        for table, columns in PLAYER_COLUMNS.items():
+            if table not in tables:
+                continue
+
+            existing = set(c['name'] for c in inspector.get_columns(table))
+            for column in columns:
+                if column + '_id' not in existing:
+                    conn.execute(text('alter table {t} add column {c}_id integer references player (player_id)'
+                                      .format(t=table, c=column)))
+                changed += _normalize_column(conn, table, column, keep=kept)
+
+            assign_player_ids(conn, table)
+
+    return changed
@@ -1,64 +1,69 @@
-import matplotlib.mlab as mlab
 import numpy as np
-import pandas as pd
-import plotly.graph_objs as go
-import plotly.offline as offl
 
-
-def dist_plot(rating_df):
-    x = np.linspace(0, 50, 500)
-
-    data_dict = {}
-    for row in rating_df.iterrows():
-        label_name = (row[1]['first_name'] + ' ' + row[1]['last_name'][0] + '.')
-        data_dict[label_name] = (x, mlab.normpdf(x, row[1]['rating'], row[1]['sigma']))
-
-    final_df = pd.DataFrame()
-
-    for k, v in data_dict.iteritems():
-        final_df[k] = v[1]
-
-    final_df['index'] = x
-    final_df.set_index('index', inplace=True)
-
-    trace_dict = dict()
-
-    for n, col in enumerate(final_df.columns):
-        trace_dict[n] = go.Scatter(
-            x=final_df.index,
-            y=final_df[col],
-            name=col
-        )
-
-    data = trace_dict.values()
-
-    # Edit the layout
-    layout = dict(title='Individual Gaussian Skill Distribution',
-                  xaxis=dict(title='Mu'),
-                  yaxis=dict(title='Value'),
-                  height=750
+from . import ratings
+from .headtohead import head_to_head_matrix
+from .metrics import timed
+
+# plotly is imported inside trajectory_plot, so only processes that render a chart pay
+# for loading it. the ratings charts are drawn in the browser from the payloads below
+
+
+def rating_distribution(state):
+    """
+    the singles mu and sigma per player, highest rated first, the browser draws
+    each player's gaussian from them instead of receiving 500 sampled points a curve
+    :param state: state.RatingState
+    """
+    table = state.singles
+    return {'alias': list(table.keys),
+            'name': [first + ' ' + last[0] + '.' if first and last else alias
+                     for alias, (first, last) in zip(table.keys, table.labels)],
+            'mu': np.round(table.mu, 4).tolist(),
+            'sigma': np.round(table.sigma, 4).tolist()}
+
+
+def win_matrix(con, state):
+    """
+    the predicted singles win probability matrix, players in ascending rating
+    order, with the observed head-to-head wins and games for the same players
+    so the browser can overlay the pairs that have played
+    """
+    table = state.singles
+    players = list(reversed(table.keys))
+
+    with timed('ratings.win_probability_matrix'):
+        matrix = ratings.win_probability_matrix(table.mu[::-1], table.sigma[::-1])
+    observed = head_to_head_matrix(con, players)
+
+    return {'players': players,
+            'matrix': np.round(matrix, 4).tolist(),
+            'wins': observed['wins'],
+            'games': observed['games']}
+
+
+def trajectory_plot(trajectory, title='Rating History'):
+    'returns a player\'s rating after each game as a plotly line with a one sigma band'
+    import plotly.graph_objs as go
+    import plotly.offline as offl
+
+    games = list(range(1, len(trajectory) + 1))
+    mu = [t['mu'] for t in trajectory]
+    sigma = [t['sigma'] for t in trajectory]
+
+    data = [
+        go.Scatter(x=games, y=[m + s for m, s in zip(mu, sigma)], line=dict(width=0),
+                   showlegend=False, hoverinfo='none'),
+        go.Scatter(x=games, y=[m - s for m, s in zip(mu, sigma)], line=dict(width=0), fill='tonexty',
+                   name='&mu; &plusmn; &sigma;', hoverinfo='none'),
+        go.Scatter(x=games, y=mu, name='Rating (&mu;)', text=[t['time'] for t in trajectory]),
+        go.Scatter(x=games, y=[t['trueskill'] for t in trajectory], name='TrueSkill'),
+    ]
+
+    layout = dict(title=title,
+                  xaxis=dict(title='Games Played'),
+                  yaxis=dict(title='Rating'),
+                  height=500
                   )
 
-    return offl.plot(dict(data=data, layout=layout), output_type='div')
-
-
-def win_probability_matrix(matrix_df):
-    'returns the win probability matrix plot as a plotly heatmap'
-
-    trace = go.Heatmap(
-        z=matrix_df.transpose().values.tolist(),
-        x=matrix_df.columns[::-1],
-        y=matrix_df.columns[::-1],
-        colorscale='Viridis'
-    )
-
-    data = [trace]
-
-    layout = go.Layout(
-        title='Win Probability Matrix',
-        xaxis=dict(title='Loser', ticks=''),
-        yaxis=dict(title='Winner', ticks=''),
-        height=750
-    )
-
-    return offl.plot(dict(data=data, layout=layout), output_type='div')
+    # plotly.js is loaded once by the page from the cdn instead of being inlined in every div
+    return offl.plot(dict(data=data, layout=layout), output_type='div', include_plotlyjs=False)
@@ -0,0 +1,96 @@
+from sqlalchemy import text
+from trueskill import global_env
+
+from .metrics import timed
+from .utils import format_timestamps
+
+
+def rating_trajectory(conn, alias, kind='singles'):
+    """
+    the player's rating after each of their games, read from rating_history
+    :param kind: 'singles' or 'doubles'
+    """
+    s = ('select game_id, timestamp, mu, sigma from rating_history '
+         'where kind = :kind and alias = :alias order by timestamp, game_id')
+    rows = conn.execute(text(s), {'kind': kind, 'alias': alias}).fetchall()
+
+    env = global_env()
+    times = format_timestamps([row[1] for row in rows]).tolist()
+
+    trajectory, previous = [], env.mu
+    for (game_id, timestamp, mu, sigma), time in zip(rows, times):
+        trajectory.append({'game_id': game_id, 'timestamp': timestamp, 'time': time, 'mu': mu, 'sigma': sigma,
+                           'trueskill': mu - (env.mu / env.sigma) * sigma, 'delta': mu - previous})
+        previous = mu
+
+    return trajectory
+
+
+def _results(conn, player_id):
+    'the player\'s singles games in replay order as (opponent, result) with result 1 won, -1 lost, 0 drawn'
+    s = '''
+    select opponent, result from (
+        select id, timestamp, player_b as opponent,
+            case when score_a > score_b then 1 when score_a < score_b then -1 else 0 end as result
+        from game where deleted = 0 and player_a_id = :player_id
+        union all
+        select id, timestamp, player_a as opponent,
+            case when score_b > score_a then 1 when score_b < score_a then -1 else 0 end as result
+        from game where deleted = 0 and player_b_id = :player_id
+    )
+    order by coalesce(timestamp, 0), id
+    '''
+    return conn.execute(text(s), {'player_id': player_id}).fetchall()
+
+
+def head_to_head(results):
+    'win/loss/draw record against each opponent, most played first'
+    records = {}
+    for opponent, result in results:
+        record = records.setdefault(opponent, {'opponent': opponent, 'won': 0, 'lost': 0, 'drawn': 0})
+        record[{1: 'won', -1: 'lost', 0: 'drawn'}[result]] += 1
+
+    return sorted(records.values(), key=lambda r: (-(r['won'] + r['lost'] + r['drawn']), r['opponent']))
+
+
+def streaks(results):
+    'the current run of identical results and the longest winning and losing runs'
+    current = longest_win = longest_loss = 0
+    last = None
+
+    for _, result in results:
+        current = current + 1 if result == last else 1
+        last = result
+        if result == 1:
+            longest_win = max(longest_win, current)
+        elif result == -1:
+            longest_loss = max(longest_loss, current)
+
+    return {'current': {'result': {1: 'won', -1: 'lost', 0: 'drawn', None: None}[last], 'length': current},
+            'longest_win': longest_win, 'longest_loss': longest_loss}
+
+
+@timed('sql.player_profile')
+def player_profile(con, alias):
+    """
+    career stats for a player from indexed lookups: rating trajectories, singles
+    head-to-head records and streaks, None when the alias is not registered
+    """
+    with con.connect() as conn:
+        player = conn.execute(text('select alias, first_name, last_name, player_id from player where alias = :alias'),
+                              {'alias': alias}).fetchone()
+        if player is None:
+            return None
+
+        results = _results(conn, player[3])
+        trajectory = rating_trajectory(conn, alias, 'singles')
+        doubles_trajectory = rating_trajectory(conn, alias, 'doubles')
+
+    return {'alias': player[0], 'first_name': player[1], 'last_name': player[2],
+            'games': len(results),
+            'won': sum(1 for _, r in results if r == 1),
+            'lost': sum(1 for _, r in results if r == -1),
+            'trajectory': trajectory,
+            'doubles_trajectory': doubles_trajectory,
+            'head_to_head': head_to_head(results),
+            'streaks': streaks(results)}
@@ -1,181 +1,328 @@
-from itertools import combinations
+import json
+import math
+import time
+import zlib
+from contextlib import contextmanager
 
 import numpy as np
-import pandas as pd
+from sqlalchemy import text
 from trueskill import Rating, rate_1vs1, rate
-from trueskill import TrueSkill
+from trueskill import TrueSkill, calc_draw_margin, global_env
 
-from .utils import remove_whitespace
+from .metrics import timed
 
 
-def calculate_ratings(game_df, rating_object=Rating(), return_type='dataframe'):
+RATING_COLUMNS = ['rating', 'sigma', 'tau', 'pi', 'trueskill']
+
+# a full ratings snapshot is stored every SNAPSHOT_INTERVAL games, so a correction
+# replays at most that many games plus the ones after the changed game
+SNAPSHOT_INTERVAL = 100
+SNAPSHOT_KEEP_RECENT = 5
+SNAPSHOT_KEEP_EVERY = 10
+
+# games are played to this many points, margin_weights measures margins against it
+TARGET_SCORE = 21
+
+SQRT2 = math.sqrt(2)
+SQRT2PI = math.sqrt(2 * math.pi)
+
+
+def team_key(player_a, player_b):
+    'teams are keyed by their sorted pair of aliases, so (a, b) and (b, a) are the same team'
+    return tuple(sorted((player_a, player_b)))
+
+
+def rate_game(ratings, player_a, player_b, score_a, score_b, rating_object=Rating()):
     """
-    calculates player ratings and outputs a summary dict or dataframe of results
-    :param rating_object: TrueSkill object
-    :param return_type: 'dict' or 'dataframe'
-    :type game_df: pd.DataFrame
+    applies a single 1v1 result to the ratings dict in place
+    :param ratings: dict of alias -> Rating, missing players start at rating_object
     """
+    r_a = ratings.get(player_a, rating_object)
+    r_b = ratings.get(player_b, rating_object)
 
-    for col in game_df.columns:
-        if 'player' in col:
-            game_df[col] = game_df[col].apply(remove_whitespace)
+    if score_a > score_b:
+        r_a, r_b = rate_1vs1(r_a, r_b)
+    elif score_a < score_b:
+        r_b, r_a = rate_1vs1(r_b, r_a)
+    else:
+        r_a, r_b = rate_1vs1(r_a, r_b, drawn=True)
 
-    all_players = set(list(game_df.player_a.unique()) + list(game_df.player_b.unique()))
-    ratings = {k :rating_object for k in all_players}
+    ratings[player_a] = r_a
+    ratings[player_b] = r_b
 
-    for row in game_df.iterrows():
-        
-        player_a = ratings[row[1]['player_a']]
-        player_b = ratings[row[1]['player_b']]
-        
-        if row[1]['score_a'] > row[1]['score_b']:
-            player_a, player_b = rate_1vs1(player_a, player_b)
-        elif row[1]['score_a'] < row[1]['score_b']:
-            player_b, player_a = rate_1vs1(player_b, player_a)
-        else:
-            player_a, player_b = rate_1vs1(player_a, player_b, drawn=True)
+    return ratings
 
-        ratings[row[1]['player_a']] = player_a
-        ratings[row[1]['player_b']] = player_b
 
-    if return_type == 'dict':
-        return ratings
+def rate_doubles_game(ratings, team_a, team_b, score_team_a, score_team_b, rating_object=Rating()):
+    """
+    applies a single 2v2 result to the individual ratings dict in place
+    :param team_a: (alias, alias) tuple
+    :param team_b: (alias, alias) tuple
+    """
+    t_a = tuple(ratings.get(p, rating_object) for p in team_a)
+    t_b = tuple(ratings.get(p, rating_object) for p in team_b)
 
-    elif return_type == 'dataframe':
+    if score_team_a > score_team_b:
+        t_a, t_b = rate([t_a, t_b], ranks=[0, 1])
+    elif score_team_a < score_team_b:
+        t_a, t_b = rate([t_a, t_b], ranks=[1, 0])
+    else:
+        t_a, t_b = rate([t_a, t_b], ranks=[0, 0])
 
-        rating_df = pd.DataFrame()
+    for player, rating in zip(team_a + team_b, tuple(t_a) + tuple(t_b)):
+        ratings[player] = rating
 
-        for k, v in ratings.iteritems():
-            rating_df.loc[k, 'rating'] = v.mu
-            rating_df.loc[k, 'sigma'] = v.sigma
-            rating_df.loc[k, 'tau'] = v.tau
-            rating_df.loc[k, 'pi'] = v.pi
-            rating_df.loc[k, 'trueskill'] = v.exposure
+    return ratings
 
-        rating_df.reset_index(inplace=True)
-        return rating_df
 
+def rate_team_game(ratings, team_a, team_b, score_team_a, score_team_b, rating_object=Rating()):
+    """
+    applies a single 2v2 result to the team ratings dict in place, each team is rated
+    as one entity keyed by team_key
+    """
+    return rate_game(ratings, team_key(*team_a), team_key(*team_b),
+                     score_team_a, score_team_b, rating_object=rating_object)
 
-def calculate_doubles_ratings(game_df, rating_object=Rating(), return_type='dataframe'):
-    
-    for col in game_df.columns:
-        if 'player' in col:
-            game_df[col] = game_df[col].apply(remove_whitespace)
 
-    all_players = set(list(game_df.player_a_team_a.unique()) + list(game_df.player_b_team_a.unique())
-                    + list(game_df.player_a_team_b.unique()) + list(game_df.player_b_team_b.unique()))
+def _cdf(x):
+    return 0.5 * math.erfc(-x / SQRT2)
 
-    ratings = {k: rating_object for k in all_players}
 
-    for row in game_df.iterrows():
+def _pdf(x):
+    return math.exp(-x * x / 2.) / SQRT2PI
 
-        player_a_team_a = ratings[row[1]['player_a_team_a']]
-        player_b_team_a = ratings[row[1]['player_b_team_a']]
-        player_a_team_b = ratings[row[1]['player_a_team_b']]
-        player_b_team_b = ratings[row[1]['player_b_team_b']]
 
-        t_a = player_a_team_a, player_b_team_a
-        t_b = player_a_team_b, player_b_team_b
+def _v_w_win(diff, draw_margin):
+    'mean and variance multipliers of the truncated gaussian for a decisive result'
+    x = diff - draw_margin
+    denom = _cdf(x)
+    v = _pdf(x) / denom if denom else -x
+    return v, v * (v + x)
 
-        if row[1]['score_team_a'] > row[1]['score_team_b']:
-            t_a, t_b = rate([t_a, t_b], ranks=[0, 1])
-        elif row[1]['score_team_a'] < row[1]['score_team_b']:
-            t_a, t_b = rate([t_a, t_b], ranks=[1, 0])
-        else:
-            t_a, t_b = rate([t_a, t_b], ranks=[0, 0])
 
-        player_a_team_a, player_b_team_a = t_a
-        player_a_team_b, player_b_team_b = t_b
+def _v_w_draw(diff, draw_margin):
+    'mean and variance multipliers of the truncated gaussian for a draw'
+    abs_diff = abs(diff)
+    a, b = draw_margin - abs_diff, -draw_margin - abs_diff
+    denom = _cdf(a) - _cdf(b)
+    v = (_pdf(b) - _pdf(a)) / denom if denom else a
+    w = v ** 2 + (a * _pdf(a) - b * _pdf(b)) / denom
+    return (-v if diff < 0 else v), w
 
-        ratings[row[1]['player_a_team_a']] = player_a_team_a
-        ratings[row[1]['player_b_team_a']] = player_b_team_a
-        ratings[row[1]['player_a_team_b']] = player_a_team_b
-        ratings[row[1]['player_b_team_b']] = player_b_team_b
 
-    if return_type == 'dict':
-        return ratings
+def index_keys(initial, *columns):
+    """
+    maps rating keys (aliases or team tuples) to integer ids once, keys of initial
+    get the first ids in iteration order and the rest are numbered game by game in
+    order of first appearance, so the keys seen by game n are a prefix of the keys
+    returns the list of keys by id and one int array of ids per column
+    """
+    ids = {}
+    for key in initial or ():
+        ids.setdefault(key, len(ids))
 
-    elif return_type == 'dataframe':
+    rows = [[ids.setdefault(k, len(ids)) for k in row] for row in zip(*columns)]
+    codes = [np.array([row[n] for row in rows], dtype=np.intp) for n in range(len(columns))]
+    keys = sorted(ids, key=ids.get)
 
-        rating_df = pd.DataFrame()
+    return keys, codes
 
-        for k, v in ratings.iteritems():
-            rating_df.loc[k, 'rating'] = v.mu
-            rating_df.loc[k, 'sigma'] = v.sigma
-            rating_df.loc[k, 'tau'] = v.tau
-            rating_df.loc[k, 'pi'] = v.pi
-            rating_df.loc[k, 'trueskill'] = v.exposure
 
-        rating_df.reset_index(inplace=True)
-        return rating_df
+def margin_weights(score_a, score_b, strength, target=TARGET_SCORE):
+    """
+    per-game update weights from the score margin, so a close or unfinished game
+    moves the ratings less than a rout
+    :param strength: 0 weights every game 1, 1 weights a game by its margin as a fraction
+        of the target score, or of the winning score when a game went past it, values
+        in between interpolate. a 21-0 game weighs 1, 5-0 stopped early 5/21, 23-21 2/23
+    :param target: points a game is played to
+    """
+    score_a = np.asarray(score_a, dtype=float)
+    score_b = np.asarray(score_b, dtype=float)
+    margin = np.abs(score_a - score_b) / np.maximum(np.maximum(score_a, score_b), target)
+
+    return (1 - strength) + strength * margin
+
+
+def replay(teams_a, teams_b, outcomes, mu, sigma, env=None, callback=None, every=1, position=0, log=None,
+           weights=None, predictions=None):
+    """
+    replays two-team games on array-backed ratings, applying the TrueSkill update
+    equations directly to mu and sigma, which are modified in place
+    :param teams_a: (n_games, team_size) int array of player ids
+    :param teams_b: (n_games, team_size) int array of player ids
+    :param outcomes: n_games array, 1 when team a won, -1 when team b won, 0 for a draw
+    :param env: TrueSkill environment for beta, tau and draw probability, defaults to the global one
+    :param callback: optional callback(n) run after game n when position + n + 1 is a multiple of every
+    :param log: optional list, (n, player id, mu, sigma) is appended for every player of game n
+    :param weights: optional n_games array scaling how far each game moves the ratings, 1 is a
+        standard TrueSkill update and 0 leaves the ratings unchanged, see margin_weights
+    :param predictions: optional list, the probability that team a wins game n is appended before it is rated
+    """
+    env = env or global_env()
+    size = 2 * teams_a.shape[1]
+    beta2 = size * env.beta ** 2
+    tau2 = env.tau ** 2
+    draw_margin = calc_draw_margin(env.draw_probability, size, env=env)
+
+    weights = weights.tolist() if weights is not None else [1.] * len(outcomes)
+
+    for n, (a, b, outcome, weight) in enumerate(zip(teams_a.tolist(), teams_b.tolist(), outcomes.tolist(),
+                                                    weights)):
+        if outcome < 0:
+            a, b = b, a
+
+        players = a + b
+        var = [sigma[p] ** 2 + tau2 for p in players]
+        c2 = beta2 + sum(var)
+        c = math.sqrt(c2)
 
+        diff = (sum(mu[p] for p in a) - sum(mu[p] for p in b)) / c
+        if predictions is not None:
+            predictions.append(_cdf(diff) if outcome >= 0 else 1 - _cdf(diff))
 
-def calculate_team_ratings(game_df, rating_object=Rating(), return_type='dataframe'):
-    for col in game_df.columns:
-        if 'player' in col:
-            game_df[col] = game_df[col].apply(remove_whitespace)
+        v, w = (_v_w_draw if outcome == 0 else _v_w_win)(diff, draw_margin / c)
+        v, w = v * weight, w * weight
 
-    all_players = set(list(game_df.player_a_team_a.unique()) + list(game_df.player_b_team_a.unique())
-                      + list(game_df.player_a_team_b.unique()) + list(game_df.player_b_team_b.unique()))
+        # all updates are computed from the pre-game ratings before any are written back
+        updates = [(p, mu[p] + (1 if i < len(a) else -1) * var[i] / c * v,
+                    math.sqrt(var[i] * (1 - var[i] / c2 * w))) for i, p in enumerate(players)]
+        for p, new_mu, new_sigma in updates:
+            mu[p], sigma[p] = new_mu, new_sigma
 
-    teams = combinations(all_players, 2)
+        if log is not None:
+            log.extend((n, p, new_mu, new_sigma) for p, new_mu, new_sigma in updates)
 
-    ratings = {k: rating_object for k in teams}
+        if callback is not None and (position + n + 1) % every == 0:
+            callback(n)
 
-    for row in game_df.iterrows():
+    return mu, sigma
 
-        try:
-            team_a = ratings[(row[1]['player_a_team_a'], row[1]['player_b_team_a'])]
-            code = 1
-        except KeyError:
-            team_a = ratings[(row[1]['player_b_team_a'], row[1]['player_a_team_a'])]
-            code = 0
 
-        try:
-            team_b = ratings[(row[1]['player_a_team_b'], row[1]['player_b_team_b'])]
-            gcode = 1
-        except KeyError:
-            team_b = ratings[(row[1]['player_b_team_b'], row[1]['player_a_team_b'])]
-            gcode = 0
+def _replay_columns(game_df, columns_a, columns_b, score_a, score_b, rating_object=Rating(),
+                    initial=None, env=None, on_checkpoint=None, every=1, position=0, history=None):
+    """
+    replays the games described by the key and score columns, returns the keys and their mu and sigma arrays
+    :param history: optional list, (game id, timestamp, key, mu, sigma) is appended for every key of every game
+    """
+    initial = initial or {}
+    keys, codes = index_keys(initial, *(columns_a + columns_b))
+
+    mu = np.full(len(keys), float(rating_object.mu))
+    sigma = np.full(len(keys), float(rating_object.sigma))
+    for n, rating in enumerate(initial.values()):
+        mu[n], sigma[n] = rating.mu, rating.sigma
+
+    score_a = np.asarray(score_a, dtype=float)
+    score_b = np.asarray(score_b, dtype=float)
+    outcomes = np.where(score_a > score_b, 1, np.where(score_a < score_b, -1, 0))
+
+    # number of keys seen by the end of each game, a snapshot leaves out players who haven't played yet
+    seen = np.maximum.accumulate(np.max(codes, axis=0) + 1) if len(game_df) else []
+
+    def callback(n):
+        k = max(int(seen[n]), len(initial))
+        on_checkpoint(position + n + 1, game_df.iloc[n], ratings_dict(keys[:k], mu[:k], sigma[:k]))
 
-        if row[1]['score_team_a'] > row[1]['score_team_b']:
-            team_a, team_b = rate_1vs1(team_a, team_b)
-        elif row[1]['score_team_a'] < row[1]['score_team_b']:
-            team_b, team_a = rate_1vs1(team_b, team_a)
-        else:
-            team_a, team_b = rate_1vs1(team_a, team_b, drawn=True)
+    log = [] if history is not None else None
 
-        if code == 1:
-            ratings[(row[1]['player_a_team_a'], row[1]['player_b_team_a'])] = team_a
-        else:
-            ratings[(row[1]['player_b_team_a'], row[1]['player_a_team_a'])] = team_a
+    k = len(columns_a)
+    replay(np.column_stack(codes[:k]).reshape(-1, k), np.column_stack(codes[k:]).reshape(-1, k),
+           outcomes, mu, sigma, env=env, callback=callback if on_checkpoint else None,
+           every=every, position=position, log=log)
 
+    if log:
+        game_ids = game_df['id'].tolist()
+        timestamps = game_df['timestamp'].tolist()
+        history.extend((game_ids[n], timestamps[n], keys[p], m, s) for n, p, m, s in log)
 
-        if gcode == 1:
-            ratings[(row[1]['player_a_team_b'], row[1]['player_b_team_b'])] = team_b
-        else:
-            ratings[(row[1]['player_b_team_b'], row[1]['player_a_team_b'])] = team_a
+    return keys, mu, sigma
+
+
+def ratings_dict(keys, mu, sigma):
+    return {k: Rating(m, s) for k, m, s in zip(keys, np.asarray(mu).tolist(), np.asarray(sigma).tolist())}
+
+
+def ratings_frame(keys, mu, sigma, env=None):
+    """
+    builds the results frame in one go from columnar arrays, with the key in the
+    'index' column followed by RATING_COLUMNS
+    """
+    import pandas as pd
+
+    env = env or global_env()
+    mu = np.asarray(mu, dtype=float)
+    sigma = np.asarray(sigma, dtype=float)
+    pi = sigma ** -2
+
+    columns = {'index': list(keys), 'rating': mu, 'sigma': sigma, 'tau': pi * mu, 'pi': pi,
+               'trueskill': mu - (env.mu / env.sigma) * sigma}
+
+    return pd.DataFrame(columns, columns=['index'] + RATING_COLUMNS)
+
+
+def calculate_ratings(game_df, rating_object=Rating(), return_type='dataframe',
+                      initial=None, on_checkpoint=None, every=1, position=0, env=None, history=None):
+    """
+    calculates player ratings and outputs a summary dict or dataframe of results
+    :param rating_object: TrueSkill object
+    :param return_type: 'dict' or 'dataframe'
+    :param initial: optional dict of alias -> Rating to start the replay from
+    :param on_checkpoint: optional callback(position, row, ratings) run after every
+        every-th game, counting from position games already replayed
+    :param env: optional TrueSkill environment, defaults to the global one
+    :param history: optional list to collect (game id, timestamp, alias, mu, sigma) after every game
+    :type game_df: pd.DataFrame
+    """
+    keys, mu, sigma = _replay_columns(game_df, [game_df.player_a], [game_df.player_b],
+                              game_df.score_a, game_df.score_b, rating_object=rating_object,
+                              initial=initial, env=env, on_checkpoint=on_checkpoint,
+                              every=every, position=position, history=history)
 
     if return_type == 'dict':
-        return ratings
+        return ratings_dict(keys, mu, sigma)
 
     elif return_type == 'dataframe':
+        return ratings_frame(keys, mu, sigma, env=env)
+
+
+def calculate_doubles_ratings(game_df, rating_object=Rating(), return_type='dataframe',
+                              initial=None, on_checkpoint=None, every=1, position=0, env=None,
+                              history=None):
+    keys, mu, sigma = _replay_columns(game_df,
+                              [game_df.player_a_team_a, game_df.player_b_team_a],
+                              [game_df.player_a_team_b, game_df.player_b_team_b],
+                              game_df.score_team_a, game_df.score_team_b,
+                              rating_object=rating_object, initial=initial, env=env,
+                              on_checkpoint=on_checkpoint, every=every, position=position,
+                              history=history)
 
-        rating_df = pd.DataFrame()
+    if return_type == 'dict':
+        return ratings_dict(keys, mu, sigma)
+
+    elif return_type == 'dataframe':
+        return ratings_frame(keys, mu, sigma, env=env)
 
-        for k, v in ratings.iteritems():
-            team = '-'.join(k)
-            rating_df.loc[team, 'rating'] = v.mu
-            rating_df.loc[team, 'sigma'] = v.sigma
-            rating_df.loc[team, 'tau'] = v.tau
-            rating_df.loc[team, 'pi'] = v.pi
-            rating_df.loc[team, 'trueskill'] = v.exposure
 
-        rating_df.reset_index(inplace=True)
-        # todo fix this filter
-        rating_df = rating_df[rating_df['sigma'] < 8.3]
+def calculate_team_ratings(game_df, rating_object=Rating(), return_type='dataframe',
+                           initial=None, on_checkpoint=None, every=1, position=0, env=None,
+                           history=None):
+    teams_a = [team_key(a, b) for a, b in zip(game_df.player_a_team_a, game_df.player_b_team_a)]
+    teams_b = [team_key(a, b) for a, b in zip(game_df.player_a_team_b, game_df.player_b_team_b)]
 
-        rating_df['player1'], rating_df['player2'] = rating_df['index'].str.split('-', 1).str
+    keys, mu, sigma = _replay_columns(game_df, [teams_a], [teams_b],
+                              game_df.score_team_a, game_df.score_team_b,
+                              rating_object=rating_object, initial=initial, env=env,
+                              on_checkpoint=on_checkpoint, every=every, position=position,
+                              history=history)
+
+    if return_type == 'dict':
+        return ratings_dict(keys, mu, sigma)
+
+    elif return_type == 'dataframe':
+        rating_df = ratings_frame(['-'.join(k) for k in keys], mu, sigma, env=env)
+        rating_df['player1'] = [k[0] for k in keys]
+        rating_df['player2'] = [k[1] for k in keys]
 
         return rating_df
 
@@ -184,3 +331,392 @@ def win_probability(rating_a, rating_b):
     delta_mu = rating_a.mu - rating_b.mu
     rs3 = np.sqrt(rating_a.sigma**2 + rating_b.sigma**2)
     return TrueSkill(backend='scipy').cdf(delta_mu/rs3)
+
+
+def win_probability_matrix(mu, sigma, beta=0.):
+    """
+    win_probability for every pair of players at once, entry [i, j] of the
+    returned N x N array is the probability that player i beats player j
+    :param mu: array of N rating means
+    :param sigma: array of N rating deviations
+    :param beta: per-game performance deviation, 0 compares the skill estimates alone the way
+        win_probability does, the environment's beta gives TrueSkill's predicted game outcome
+    """
+    from scipy.special import ndtr
+
+    mu = np.asarray(mu, dtype=float)
+    sigma = np.asarray(sigma, dtype=float)
+
+    delta_mu = mu[:, np.newaxis] - mu[np.newaxis, :]
+    rs3 = np.sqrt(sigma[:, np.newaxis] ** 2 + sigma[np.newaxis, :] ** 2 + 2 * beta ** 2)
+
+    return ndtr(delta_mu / rs3)
+
+
+def _rating_record(rating):
+    return {'rating': rating.mu, 'sigma': rating.sigma, 'tau': rating.tau,
+            'pi': rating.pi, 'trueskill': rating.exposure}
+
+
+def load_ratings(conn, table, keys, key_column='alias'):
+    """
+    reads the stored ratings for keys as a dict of key -> Rating, keys without a
+    stored row are left out
+    """
+    keys = list(keys)
+    params = {'k%d' % n: k for n, k in enumerate(keys)}
+    s = 'select {key}, rating, sigma from {table} where {key} in ({params})'.format(
+        key=key_column, table=table, params=', '.join(':' + p for p in params))
+
+    return {row[0]: Rating(row[1], row[2]) for row in conn.execute(text(s), params)}
+
+
+def upsert_ratings(conn, table, ratings, key_column='alias', extra_columns=None):
+    """
+    writes the given ratings into table in place, updating existing rows and
+    inserting rows for keys that are not stored yet
+    :param ratings: dict of key -> Rating
+    :param extra_columns: optional dict of key -> {column: value} stored alongside
+    """
+    extra_columns = extra_columns or {}
+
+    for key, rating in ratings.items():
+        record = _rating_record(rating)
+        record.update(extra_columns.get(key, {}))
+        record[key_column] = key
+
+        columns = [c for c in record if c != key_column]
+        update = 'update {table} set {sets} where {key} = :{key}'.format(
+            table=table, key=key_column, sets=', '.join('%s = :%s' % (c, c) for c in columns))
+
+        if conn.execute(text(update), record).rowcount == 0:
+            insert = 'insert into {table} ({cols}) values ({params})'.format(
+                table=table, cols=', '.join(record), params=', '.join(':' + c for c in record))
+            conn.execute(text(insert), record)
+
+
+def _after_point(point, timestamp='coalesce(timestamp, 0)', id_column='id'):
+    'sql filter and params for rows strictly after a (timestamp, game id) point'
+    if point is None:
+        return '1 = 1', {}
+
+    s = '({ts} > :ts or ({ts} = :ts and {id} > :id))'.format(ts=timestamp, id=id_column)
+    return s, {'ts': point[0], 'id': point[1]}
+
+
+def encode_snapshot(ratings):
+    'compresses a ratings dict into a compact blob of [key, mu, sigma] entries'
+    entries = [[list(k) if isinstance(k, tuple) else k, v.mu, v.sigma] for k, v in ratings.items()]
+    return zlib.compress(json.dumps(entries).encode('utf-8'))
+
+
+def decode_snapshot(blob):
+    entries = json.loads(zlib.decompress(blob).decode('utf-8'))
+    return {tuple(k) if isinstance(k, list) else k: Rating(mu, sigma) for k, mu, sigma in entries}
+
+
+def save_snapshot(conn, kind, position, point, ratings):
+    """
+    stores the complete ratings dict as it stands after the game at point
+    :param position: number of games replayed to reach this state
+    :param point: (timestamp, game id) of the last game included
+    """
+    conn.execute(text('insert into rating_snapshot (kind, position, timestamp, game_id, ratings) '
+                      'values (:kind, :position, :ts, :id, :ratings)'),
+                 {'kind': kind, 'position': position, 'ts': point[0], 'id': point[1],
+                  'ratings': encode_snapshot(ratings)})
+
+
+def load_snapshot(conn, kind, before=None):
+    """
+    loads the last snapshot taken strictly before the (timestamp, game id) point before,
+    returns (position, point, ratings), or (0, None, {}) when there is none to start from
+    """
+    if before is None:
+        return 0, None, {}
+
+    s = ('select position, timestamp, game_id, ratings from rating_snapshot '
+         'where kind = :kind and (timestamp < :ts or (timestamp = :ts and game_id < :id)) '
+         'order by timestamp desc, game_id desc limit 1')
+    row = conn.execute(text(s), {'kind': kind, 'ts': before[0], 'id': before[1]}).fetchone()
+
+    if row is None:
+        return 0, None, {}
+
+    return row[0], (row[1], row[2]), decode_snapshot(row[3])
+
+
+def prune_snapshots(conn, kind, keep_recent=SNAPSHOT_KEEP_RECENT, keep_every=SNAPSHOT_KEEP_EVERY):
+    """
+    retention policy, the newest keep_recent snapshots are kept and older ones are
+    thinned out to one every keep_every snapshot intervals
+    """
+    s = ('select id, position from rating_snapshot where kind = :kind '
+         'order by timestamp desc, game_id desc')
+    rows = conn.execute(text(s), {'kind': kind}).fetchall()
+
+    stale = [{'id': row[0]} for row in rows[keep_recent:]
+             if row[1] % (SNAPSHOT_INTERVAL * keep_every) != 0]
+
+    if stale:
+        conn.execute(text('delete from rating_snapshot where id = :id'), stale)
+
+
+def write_history(conn, kind, entries):
+    'stores (game id, timestamp, key, mu, sigma) entries in rating_history, team keys joined with -'
+    records = [{'kind': kind, 'game_id': game_id, 'ts': ts, 'alias': '-'.join(k) if isinstance(k, tuple) else k,
+                'mu': mu, 'sigma': sigma} for game_id, ts, k, mu, sigma in entries]
+    if records:
+        conn.execute(text('insert into rating_history (kind, game_id, timestamp, alias, mu, sigma) '
+                          'values (:kind, :game_id, :ts, :alias, :mu, :sigma)'), records)
+
+
+def _game_history(game, ratings):
+    return [(game.id, game.timestamp or 0, k, r.mu, r.sigma) for k, r in ratings.items()]
+
+
+def history_missing(con, kind, table):
+    'true when table has games but rating_history has nothing for kind yet, i.e. it needs a full replay'
+    s = ('select exists (select 1 from {table} where deleted = 0) '
+         'and not exists (select 1 from rating_history where kind = :kind)').format(table=table)
+    with con.connect() as conn:
+        return bool(conn.execute(text(s), {'kind': kind}).scalar())
+
+
+@timed('sql.read_games')
+def _read_games(conn, table, after=None):
+    import pandas as pd
+
+    where, params = _after_point(after)
+    s = ('select * from {table} where deleted = 0 and {where} '
+         'order by coalesce(timestamp, 0), id').format(table=table, where=where)
+
+    games = pd.read_sql(text(s), con=conn, params=params)
+    games['timestamp'] = games['timestamp'].fillna(0)
+    return games
+
+
+@timed('ratings.replay')
+def replay_ratings(conn, kind, table, calculate, since=None):
+    """
+    replays the games in table through calculate, starting from the last snapshot
+    taken before since and returning the complete ratings dataframe
+
+    snapshots at or after since are stale and get retaken every SNAPSHOT_INTERVAL
+    games along the way, and rating_history is rewritten for the replayed games
+    :param since: (timestamp, game id) of the earliest changed game, None replays everything
+    """
+    since = tuple(since) if since is not None else None
+    position, point, initial = load_snapshot(conn, kind, since)
+
+    where, params = _after_point(point, timestamp='timestamp', id_column='game_id')
+    params['kind'] = kind
+    conn.execute(text('delete from rating_snapshot where kind = :kind and ' + where), params)
+    conn.execute(text('delete from rating_history where kind = :kind and ' + where), params)
+
+    def on_checkpoint(n, row, ratings):
+        save_snapshot(conn, kind, n, (float(row['timestamp']), int(row['id'])), ratings)
+
+    history = []
+    ratingdf = calculate(_read_games(conn, table, after=point), initial=initial,
+                         on_checkpoint=on_checkpoint, every=SNAPSHOT_INTERVAL, position=position,
+                         history=history)
+    write_history(conn, kind, history)
+    prune_snapshots(conn, kind)
+
+    return ratingdf
+
+
+def _snapshot_if_due(conn, kind, table, game, load_all):
+    'takes a snapshot after an incrementally rated game once SNAPSHOT_INTERVAL games have passed'
+    row = conn.execute(text('select position, timestamp, game_id from rating_snapshot where kind = :kind '
+                            'order by timestamp desc, game_id desc limit 1'), {'kind': kind}).fetchone()
+    position, point = (row[0], (row[1], row[2])) if row is not None else (0, None)
+
+    where, params = _after_point(point)
+    s = 'select count(*) from {table} where deleted = 0 and {where}'.format(table=table, where=where)
+    pending = conn.execute(text(s), params).scalar()
+
+    if pending >= SNAPSHOT_INTERVAL:
+        save_snapshot(conn, kind, position + pending, (game.timestamp or 0, game.id), load_all(conn))
+        prune_snapshots(conn, kind)
+
+
+def _load_all(table, key_column='alias'):
+    def load(conn):
+        s = 'select {key}, rating, sigma from {table}'.format(key=key_column, table=table)
+        return {row[0]: Rating(row[1], row[2]) for row in conn.execute(text(s))}
+    return load
+
+
+def _load_all_teams(conn):
+    s = 'select player1, player2, rating, sigma from team_doubles_ratings'
+    return {(row[0], row[1]): Rating(row[2], row[3]) for row in conn.execute(text(s))}
+
+
+def ratings_version(con):
+    'the current ratings version, 0 before anything has been published'
+    with con.connect() as conn:
+        version = conn.execute(text('select version from ratings_version where id = 1')).scalar()
+    return version or 0
+
+
+def bump_ratings_version(conn):
+    'marks newly published ratings, so caches keyed on the version miss'
+    params = {'ts': time.time()}
+    s = 'update ratings_version set version = version + 1, timestamp = :ts where id = 1'
+
+    if conn.execute(text(s), params).rowcount == 0:
+        conn.execute(text('insert into ratings_version (id, version, timestamp) values (1, 1, :ts)'), params)
+
+
+@contextmanager
+def ratings_transaction(con):
+    """
+    a transaction whose first statement takes the ratings write lock, so recomputes
+    and publishes from every process run one at a time and each reads the games
+    and ratings as the previous one left them
+
+    sqlite takes its database write lock on the update, like begin immediate would,
+    other databases lock the ratings_version row until commit
+    """
+    with con.begin() as conn:
+        s = 'update ratings_version set version = version where id = 1'
+        if conn.execute(text(s)).rowcount == 0:
+            conn.execute(text('insert into ratings_version (id, version, timestamp) values (1, 0, :ts)'),
+                         {'ts': time.time()})
+        yield conn
+
+
+@timed('ratings.publish')
+def publish_ratings(conn, frames):
+    """
+    replaces the contents of ratings tables without readers ever seeing them half written
+
+    runs in the caller's ratings_transaction: each frame is bulk loaded with
+    executemany into a temporary <table>_staging copy private to the connection,
+    then every table's rows are swapped in from it and the ratings version is
+    bumped, keeping the tables' primary keys and indexes. readers see the old
+    ratings until the transaction commits
+    :param frames: dict of table name -> frame whose columns match the table
+    """
+    for table, frame in frames.items():
+        staging = table + '_staging'
+        columns = ', '.join(frame.columns)
+
+        conn.execute(text('create temporary table if not exists {s} as select * from {t} where 1 = 0'
+                          .format(s=staging, t=table)))
+        conn.execute(text('delete from %s' % staging))
+
+        records = frame.to_dict('records')
+        if records:
+            conn.execute(text('insert into {s} ({cols}) values ({params})'.format(
+                s=staging, cols=columns, params=', '.join(':' + c for c in frame.columns))), records)
+
+        conn.execute(text('delete from %s' % table))
+        conn.execute(text('insert into {t} ({cols}) select {cols} from {s}'.format(t=table, s=staging, cols=columns)))
+
+    bump_ratings_version(conn)
+
+
+def _incremental_state(conn, kind, game):
+    """
+    where game stands in rating_history: 'rated' when a replay already included it,
+    'behind' when a game after it in replay order has been rated, e.g. by another
+    process, so it needs a replay from its point, or 'next' to rate it incrementally
+    """
+    point = {'kind': kind, 'ts': game.timestamp or 0, 'id': game.id}
+    s = 'select 1 from rating_history where kind = :kind and timestamp = :ts and game_id = :id limit 1'
+    if conn.execute(text(s), point).fetchone() is not None:
+        return 'rated'
+
+    where, params = _after_point((point['ts'], point['id']), timestamp='timestamp', id_column='game_id')
+    s = 'select 1 from rating_history where kind = :kind and %s limit 1' % where
+    if conn.execute(text(s), dict(params, kind=kind)).fetchone() is not None:
+        return 'behind'
+    return 'next'
+
+
+@timed('ratings.push_singles')
+def push_new_ratings(con=None, game=None, since=None):
+    """
+    recalculates player ratings and pushes them to the database
+
+    when game is given it is treated as the newest game, only its two players are
+    re-rated starting from their stored ratings and their rows are upserted.
+    otherwise games are replayed from the last snapshot before since, the
+    (timestamp, game id) of a deleted or edited game, or from scratch without it.
+    either way it runs in one ratings_transaction, and a game that turns out not
+    to be the newest rated one is replayed from instead
+    """
+    with ratings_transaction(con) as conn:
+        if game is not None:
+            state = _incremental_state(conn, 'singles', game)
+            if state == 'rated':
+                return
+
+            if state == 'next':
+                player_a, player_b = game.player_a, game.player_b
+
+                ratings = load_ratings(conn, 'ratings', [player_a, player_b])
+                rate_game(ratings, player_a, player_b, game.score_a, game.score_b)
+                upsert_ratings(conn, 'ratings', ratings)
+                write_history(conn, 'singles', _game_history(game, ratings))
+
+                _snapshot_if_due(conn, 'singles', 'game', game, _load_all('ratings'))
+                bump_ratings_version(conn)
+                return
+
+            since = (game.timestamp or 0, game.id)
+
+        ratingdf = replay_ratings(conn, 'singles', 'game', calculate_ratings, since=since)
+        publish_ratings(conn, {'ratings': ratingdf.rename(columns={'index': 'alias'})})
+
+
+@timed('ratings.push_doubles')
+def push_new_doubles_ratings(con=None, game=None, since=None):
+    """
+    recalculates doubles ratings and pushes them to the database
+
+    when game is given it is treated as the newest game and only its four players
+    and two teams are re-rated and upserted, otherwise games are replayed from the
+    last snapshot before since like push_new_ratings
+    """
+    with ratings_transaction(con) as conn:
+        if game is not None:
+            state = _incremental_state(conn, 'doubles', game)
+            if state == 'rated':
+                return
+
+            if state == 'next':
+                team_a = (game.player_a_team_a, game.player_b_team_a)
+                team_b = (game.player_a_team_b, game.player_b_team_b)
+                teams = [team_key(*team_a), team_key(*team_b)]
+
+                ratings = load_ratings(conn, 'doubles_ratings', team_a + team_b)
+                rate_doubles_game(ratings, team_a, team_b, game.score_team_a, game.score_team_b)
+                upsert_ratings(conn, 'doubles_ratings', ratings)
+                write_history(conn, 'doubles', _game_history(game, ratings))
+
+                stored = load_ratings(conn, 'team_doubles_ratings', ['-'.join(t) for t in teams],
+                                      key_column='team')
+                team_ratings = {t: stored['-'.join(t)] for t in teams if '-'.join(t) in stored}
+                rate_team_game(team_ratings, team_a, team_b, game.score_team_a, game.score_team_b)
+
+                upsert_ratings(conn, 'team_doubles_ratings',
+                               {'-'.join(k): v for k, v in team_ratings.items()}, key_column='team',
+                               extra_columns={'-'.join(k): {'player1': k[0], 'player2': k[1]}
+                                              for k in team_ratings})
+                write_history(conn, 'team', _game_history(game, team_ratings))
+
+                _snapshot_if_due(conn, 'doubles', 'doubles_game', game, _load_all('doubles_ratings'))
+                _snapshot_if_due(conn, 'team', 'doubles_game', game, _load_all_teams)
+                bump_ratings_version(conn)
+                return
+
+            since = (game.timestamp or 0, game.id)
+
+        ratingdf = replay_ratings(conn, 'doubles', 'doubles_game', calculate_doubles_ratings, since=since)
+        team_ratingdf = replay_ratings(conn, 'team', 'doubles_game', calculate_team_ratings, since=since)
+        publish_ratings(conn, {'doubles_ratings': ratingdf.rename(columns={'index': 'alias'}),
+                               'team_doubles_ratings': team_ratingdf.rename(columns={'index': 'team'})})
@@ -0,0 +1,107 @@
+import threading
+
+import numpy as np
+from sqlalchemy import text
+from trueskill import global_env
+
+from .ratings import ratings_version
+
+# kind -> select of the key, two label columns, rating, sigma and trueskill of every published rating
+STATE_QUERIES = {
+    'singles': '''select r.alias, p.first_name, p.last_name, r.rating, r.sigma, r.trueskill
+                  from ratings r left join player p on p.alias = r.alias''',
+    'doubles': '''select r.alias, p.first_name, p.last_name, r.rating, r.sigma, r.trueskill
+                  from doubles_ratings r left join player p on p.alias = r.alias''',
+    'team': 'select team, player1, player2, rating, sigma, trueskill from team_doubles_ratings',
+}
+
+_state = None
+_state_lock = threading.Lock()
+
+
+def _frozen(values):
+    values = np.array(values, dtype=float)
+    values.setflags(write=False)
+    return values
+
+
+class RatingTable(object):
+    """
+    one kind's published ratings as read-only arrays, rows ordered by rating
+    highest first with ties broken by key, and a key -> row index
+    """
+
+    def __init__(self, rows):
+        rows = sorted(rows, key=lambda r: (-r[3], r[0]))
+
+        self.keys = tuple(r[0] for r in rows)
+        self.labels = tuple((r[1], r[2]) for r in rows)
+        self.mu = _frozen([r[3] for r in rows])
+        self.sigma = _frozen([r[4] for r in rows])
+        self.trueskill = _frozen([r[5] for r in rows])
+        self.index = {key: n for n, key in enumerate(self.keys)}
+
+    def __len__(self):
+        return len(self.keys)
+
+    def lookup(self, keys):
+        """
+        mu and sigma arrays shaped like keys, a nested list of keys; keys without a
+        published rating get the environment's starting rating
+        """
+        env = global_env()
+        # one extra row at the end holds the starting rating
+        rows = np.array([[self.index.get(k, -1) for k in team] for team in keys], dtype=np.intp)
+        mu = np.append(self.mu, env.mu)
+        sigma = np.append(self.sigma, env.sigma)
+        return mu[rows], sigma[rows]
+
+    def records(self, key_column, label_columns):
+        'the rows as dicts, highest rated first, for templates and json'
+        return [{key_column: key, label_columns[0]: label[0], label_columns[1]: label[1],
+                 'rating': mu, 'sigma': sigma, 'trueskill': trueskill}
+                for key, label, mu, sigma, trueskill in zip(self.keys, self.labels, self.mu.tolist(),
+                                                            self.sigma.tolist(), self.trueskill.tolist())]
+
+
+class RatingState(object):
+    'the singles, doubles and team ratings of one ratings version, never modified once built'
+
+    def __init__(self, version, singles, doubles, team):
+        self.version = version
+        self.singles = singles
+        self.doubles = doubles
+        self.team = team
+
+    @classmethod
+    def load(cls, con, version):
+        with con.connect() as conn:
+            tables = {kind: RatingTable(conn.execute(text(s)).fetchall()) for kind, s in STATE_QUERIES.items()}
+        return cls(version, **tables)
+
+
+def rating_state(con):
+    """
+    the current ratings of this process, reloaded from the database only when a
+    publish has moved the ratings version on. a reload swaps in a new RatingState,
+    readers holding the previous one keep a consistent view until they are done
+    """
+    global _state
+
+    version = ratings_version(con)
+    state = _state
+    if state is not None and state.version == version:
+        return state
+
+    with _state_lock:
+        if _state is None or _state.version != version:
+            _state = RatingState.load(con, version)
+        return _state
+
+
+def clear_rating_state():
+    'drops this process\'s rating state, the next reader reloads it'
+    global _state
+
+    with _state_lock:
+        _state = None
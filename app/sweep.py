@@ -0,0 +1,162 @@
+import itertools
+import time
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+import click
+import numpy as np
+from flask.cli import with_appcontext
+from trueskill import TrueSkill
+
+from .model import db
+from .ratings import _read_games, index_keys, margin_weights, replay, team_key
+
+# TrueSkill environment parameters a sweep can vary, anything left out takes the
+# TrueSkill default, which for sigma, beta and tau is derived from mu
+ENV_PARAMETERS = ('mu', 'sigma', 'beta', 'tau', 'draw_probability')
+
+# kind -> (table, team a columns, team b columns, score columns)
+SWEEP_KINDS = {
+    'singles': ('game', ['player_a'], ['player_b'], ('score_a', 'score_b')),
+    'doubles': ('doubles_game', ['player_a_team_a', 'player_b_team_a'], ['player_a_team_b', 'player_b_team_b'],
+                ('score_team_a', 'score_team_b')),
+    'team': ('doubles_game', ['player_a_team_a', 'player_b_team_a'], ['player_a_team_b', 'player_b_team_b'],
+             ('score_team_a', 'score_team_b')),
+}
+
+# predictions are clipped away from 0 and 1 so one confident miss can't make the log-loss infinite
+EPSILON = 1e-15
+
+
+def parameter_grid(grid):
+    """
+    every combination of the grid's values
+    :param grid: dict of parameter name -> list of values, ENV_PARAMETERS and 'margin'
+    :return: list of dicts, one per configuration
+    """
+    unknown = set(grid) - set(ENV_PARAMETERS + ('margin',))
+    if unknown:
+        raise ValueError('unknown sweep parameter(s): %s' % ', '.join(sorted(unknown)))
+
+    names = sorted(grid)
+    return [dict(zip(names, values)) for values in itertools.product(*(grid[name] for name in names))]
+
+
+def load_games(con, kind='singles'):
+    """
+    reads a kind's games in replay order into the integer arrays replay takes,
+    small enough to ship to every worker process
+    """
+    table, columns_a, columns_b, (score_a, score_b) = SWEEP_KINDS[kind]
+    df = _read_games(con, table)
+
+    if kind == 'team':
+        sides = [[team_key(*pair) for pair in zip(*(df[c] for c in columns))] for columns in (columns_a, columns_b)]
+    else:
+        sides = [df[c] for c in columns_a + columns_b]
+
+    keys, codes = index_keys(None, *sides)
+    k = len(codes) // 2
+    scores_a = df[score_a].values.astype(float)
+    scores_b = df[score_b].values.astype(float)
+
+    return {'players': len(keys),
+            'teams_a': np.column_stack(codes[:k]).reshape(-1, k),
+            'teams_b': np.column_stack(codes[k:]).reshape(-1, k),
+            'outcomes': np.where(scores_a > scores_b, 1, np.where(scores_a < scores_b, -1, 0)),
+            'score_a': scores_a,
+            'score_b': scores_b}
+
+
+def evaluate(games, params, holdout=0.2):
+    """
+    replays every game under one configuration, predicting each game from the ratings
+    before it, and scores the predictions on the last holdout fraction of games
+    :param games: load_games result
+    :param params: dict of ENV_PARAMETERS and optionally 'margin', the margin_weights strength
+    :return: params with accuracy and log_loss over the decisive held-out games added
+    """
+    start = time.time()
+    env = TrueSkill(**{k: v for k, v in params.items() if k in ENV_PARAMETERS})
+
+    mu = np.full(games['players'], float(env.mu))
+    sigma = np.full(games['players'], float(env.sigma))
+    weights = margin_weights(games['score_a'], games['score_b'], params['margin']) if params.get('margin') else None
+
+    predictions = []
+    replay(games['teams_a'], games['teams_b'], games['outcomes'], mu, sigma, env=env,
+           weights=weights, predictions=predictions)
+
+    first = int(len(predictions) * (1 - holdout))
+    p = np.clip(np.array(predictions[first:]), EPSILON, 1 - EPSILON)
+    outcomes = games['outcomes'][first:]
+
+    # draws have no winner to predict
+    decisive = outcomes != 0
+    p, won = p[decisive], outcomes[decisive] > 0
+
+    result = dict(params)
+    result.update({
+        'games': int(decisive.sum()),
+        'accuracy': float(np.mean((p > 0.5) == won)) if len(p) else None,
+        'log_loss': float(-np.mean(np.where(won, np.log(p), np.log(1 - p)))) if len(p) else None,
+        'seconds': time.time() - start,
+    })
+    return result
+
+
+def sweep(con, grid, kind='singles', holdout=0.2, workers=None):
+    """
+    evaluates every configuration of the grid in a pool of processes, one replay each
+    :param workers: number of processes, defaults to the number of cpus
+    :return: list of evaluate results, lowest log-loss first
+    """
+    games = load_games(con, kind)
+    configs = parameter_grid(grid)
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        results = list(pool.map(partial(evaluate, games, holdout=holdout), configs))
+
+    return sorted(results, key=lambda r: r['log_loss'] if r['log_loss'] is not None else float('inf'))
+
+
+def _values(ctx, param, value):
+    'comma separated floats from a cli option'
+    if value is None:
+        return None
+    try:
+        return [float(v) for v in value.split(',')]
+    except ValueError:
+        raise click.BadParameter('expected comma separated numbers, got %r' % value)
+
+
+@click.command('sweep-ratings')
+@click.option('--kind', type=click.Choice(sorted(SWEEP_KINDS)), default='singles')
+@click.option('--mu', callback=_values, help='comma separated values, e.g. 20,25,30')
+@click.option('--sigma', callback=_values)
+@click.option('--beta', callback=_values)
+@click.option('--tau', callback=_values)
+@click.option('--draw-probability', callback=_values)
+@click.option('--margin', callback=_values, help='score margin weighting strengths between 0 and 1')
+@click.option('--holdout', type=float, default=0.2, help='fraction of the most recent games scored')
+@click.option('--workers', type=int, default=None, help='processes, the number of cpus by default')
+@click.option('--top', type=int, default=10, help='configurations to print')
+@with_appcontext
+def sweep_command(kind, mu, sigma, beta, tau, draw_probability, margin, holdout, workers, top):
+    'replay the history under a grid of TrueSkill parameters and rank them by held-out log-loss'
+    grid = {name: values for name, values in [('mu', mu), ('sigma', sigma), ('beta', beta), ('tau', tau),
+                                              ('draw_probability', draw_probability), ('margin', margin)]
+            if values is not None}
+
+    start = time.time()
+    results = sweep(db.engine, grid, kind=kind, holdout=holdout, workers=workers)
+
+    names = sorted(grid)
+    click.echo('  '.join(['%10s' % n for n in names] + ['  accuracy', '  log_loss']))
+    for r in results[:top]:
+        accuracy = '%10.4f' % r['accuracy'] if r['accuracy'] is not None else '%10s' % '-'
+        log_loss = '%10.4f' % r['log_loss'] if r['log_loss'] is not None else '%10s' % '-'
+        click.echo('  '.join(['%10.4g' % r[n] for n in names] + [accuracy, log_loss]))
+
+    games = results[0]['games'] if results else 0
+    click.echo('%d configurations scored on %d held-out games in %.1fs' % (len(results), games, time.time() - start))
@@ -1,13 +1,11 @@
-from flask import flash
-from trueskill import Rating
+from flask import current_app, flash, has_app_context
 
+DISPLAY_TIMEZONE = 'America/New_York'
 
-def remove_whitespace(x):
-    try:
-        x = "".join(x.split())
-    except:
-        pass
-    return x
+
+def normalize_alias(alias):
+    'aliases are stored without whitespace, anything that is not a string passes through unchanged'
+    return ''.join(alias.split()) if isinstance(alias, str) else alias
 
 
 def flash_errors(form):
@@ -19,5 +17,36 @@ def flash_errors(form):
             ))
 
 
-def rating_df_to_dict(rating_df):
-    return {row[1]['alias']: Rating(row[1]['rating'], row[1]['sigma']) for row in rating_df.iterrows()}
+def display_timezone():
+    'the DISPLAY_TIMEZONE configured for this deployment'
+    if has_app_context():
+        return current_app.config.get('DISPLAY_TIMEZONE', DISPLAY_TIMEZONE)
+    return DISPLAY_TIMEZONE
+
+
+def format_timestamps(timestamps, tz=None):
+    """
+    converts unix timestamps to 'YYYY-mm-dd HH:MM:SS TZ' local time strings in one
+    vectorized pass, missing timestamps come back as None
+    :param tz: timezone name, defaults to display_timezone()
+    """
+    import numpy as np
+    import pandas as pd
+
+    tz = tz or display_timezone()
+
+    utc = pd.to_datetime(pd.Series(timestamps, dtype=float), unit='s', utc=True)
+    if utc.empty:
+        return pd.Series([], dtype=object)
+
+    local = utc.dt.tz_convert(tz).dt.tz_localize(None)
+    text = np.datetime_as_string(local.values.astype('datetime64[s]'), unit='s')
+
+    # the zone abbreviation only depends on the utc offset, so strftime runs once per distinct offset
+    offsets = (local - utc.dt.tz_localize(None)).values
+    distinct, inverse = np.unique(offsets, return_inverse=True)
+    names = np.array(['' if pd.isnull(offset) else utc[np.argmax(offsets == offset)].tz_convert(tz).strftime(' %Z')
+                      for offset in distinct])
+
+    formatted = pd.Series(np.char.add(np.char.replace(text, 'T', ' '), names[inverse]), dtype=object)
+    return formatted.where(utc.notnull().values, None)
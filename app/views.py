@@ -0,0 +1,183 @@
+import time
+
+from flask import Blueprint, abort, current_app, flash, make_response, redirect, render_template, request
+from sqlalchemy import exists, text
+
+from .form import MatchForm, PlayerForm, DoublesMatchForm
+from .headtohead import add_games, remove_games
+from .model import Game, DoublesGame, Player, db
+from .plots import trajectory_plot
+from .profile import player_profile
+from .state import rating_state
+from .utils import flash_errors, normalize_alias
+from .worker import recompute
+
+views = Blueprint('views', __name__)
+
+
+@views.route('/')
+def homepage():
+    paragraph = '''
+    This is an app to track Ping Pong games, and then calculate
+    player ratings using TrueSkill.
+    '''
+    return render_template("index.html", paragraph=paragraph)
+
+
+@views.route('/games', methods=['GET'])
+def matches():
+    return render_template('gamelog.html')
+
+
+@views.route('/record_match', methods=['GET', 'POST'])
+def record_match():
+    s = '''
+    select
+    alias,
+    printf('%s %s', first_name, last_name) as name
+    from player
+    '''
+    with db.engine.connect() as conn:
+        choice_list = sorted((row[0], row[1]) for row in conn.execute(text(s)))
+
+    form = MatchForm(csrf_enabled=False)
+    form.player_a.choices = choice_list
+    form.player_b.choices = choice_list
+
+    if request.method == 'POST' and form.validate_on_submit():
+        record = Game(player_a=form.player_a.data, player_b=form.player_b.data,
+                      score_a=form.score_a.data, score_b=form.score_b.data,
+                      deleted=0, timestamp=time.time())
+        db.session.add(record)
+        add_games(db.session, [(record.player_a, record.player_b, record.score_a, record.score_b,
+                                record.timestamp)])
+        db.session.commit()
+
+        recompute.submit('singles', game_id=record.id)
+
+        return redirect('/games')
+
+    else:
+        flash_errors(form)
+
+    return render_template('addmatch.html', form=form)
+
+
+@views.route('/record_doubles', methods=['GET', 'POST'])
+def record_doubles():
+    s = '''
+    select
+    alias,
+    printf('%s %s', first_name, last_name) as name
+    from player
+    '''
+    with db.engine.connect() as conn:
+        choice_list = sorted((row[0], row[1]) for row in conn.execute(text(s)))
+
+    form = DoublesMatchForm(csrf_enabled=False)
+    form.player_a_team_a.choices = choice_list
+    form.player_b_team_a.choices = choice_list
+    form.player_a_team_b.choices = choice_list
+    form.player_b_team_b.choices = choice_list
+
+    if request.method == 'POST' and form.validate_on_submit():
+        record = DoublesGame(
+            player_a_team_a=form.player_a_team_a.data,
+            player_b_team_a=form.player_b_team_a.data,
+            player_a_team_b=form.player_a_team_b.data,
+            player_b_team_b=form.player_b_team_b.data,
+            score_team_a=form.score_team_a.data,
+            score_team_b=form.score_team_b.data,
+            deleted=0, timestamp=time.time()
+        )
+
+        db.session.add(record)
+        db.session.commit()
+
+        recompute.submit('doubles', game_id=record.id)
+
+        return redirect('/games')
+    else:
+        flash_errors(form)
+
+    return render_template('adddoubles.html', form=form)
+
+
+@views.route('/register', methods=['GET', 'POST'])
+def register():
+    form = PlayerForm(csrf_enabled=False)
+
+    if request.method == 'POST' and form.validate_on_submit():
+        alias = normalize_alias(form.alias.data).lower()
+        if db.session.query(exists().where(Player.alias == alias)).scalar():
+            flash('Alias already taken! Are you registered already?', category='warn')
+        else:
+            record = Player(alias=alias, first_name=form.first_name.data,
+                            last_name=form.last_name.data)
+            db.session.add(record)
+            db.session.commit()
+            return redirect('/record_match')
+
+        return render_template('register.html')
+
+    else:
+        flash_errors(form)
+
+    return render_template('register.html')
+
+
+@views.route('/ratings', methods=['GET'])
+def ratings():
+    state = rating_state(db.engine)
+    etag = 'ratings-%d' % state.version
+
+    if etag in request.if_none_match:
+        response = current_app.response_class(status=304)
+    else:
+        response = make_response(render_template(
+            'ratings.html',
+            singles_ratings=state.singles.records('alias', ('first_name', 'last_name')),
+            doubles_ratings=state.doubles.records('alias', ('first_name', 'last_name')),
+            team_df=state.team.records('team', ('player1', 'player2'))))
+
+    response.set_etag(etag)
+    response.cache_control.no_cache = True
+
+    return response
+
+
+@views.route('/player/<alias>', methods=['GET'])
+def player(alias):
+    profile = player_profile(db.engine, alias)
+    if profile is None:
+        abort(404)
+
+    singles_chart = trajectory_plot(profile['trajectory'], 'Singles Rating') if profile['trajectory'] else None
+    doubles_chart = (trajectory_plot(profile['doubles_trajectory'], 'Doubles Rating')
+                     if profile['doubles_trajectory'] else None)
+
+    return render_template('player.html', profile=profile, singles_chart=singles_chart,
+                           doubles_chart=doubles_chart)
+
+
+@views.route('/delete/<game_id>', methods=['POST'])
+def delete_game(game_id):
+    game = Game.query.filter_by(id=game_id).first()
+    if game.deleted:
+        return redirect('/games')
+
+    game.deleted = 1
+    db.session.flush()
+    remove_games(db.session, [(game.player_a, game.player_b, game.score_a, game.score_b, game.timestamp)])
+
+    db.session.commit()
+    recompute.submit('singles', since=(game.timestamp or 0, game.id))
+
+    return redirect('/games')
+
+
+@views.route('/recalculate', methods=['POST'])
+def recalculate():
+    recompute.submit('singles', full=True)
+
+    return redirect('/ratings')
@@ -0,0 +1,177 @@
+import threading
+import time
+
+from sqlalchemy import text
+
+from .cache import ratings_win_matrix
+from .metrics import timed
+from .model import db
+from .ratings import push_new_ratings, push_new_doubles_ratings
+from .state import rating_state
+
+KINDS = {
+    'singles': ('game', push_new_ratings),
+    'doubles': ('doubles_game', push_new_doubles_ratings),
+}
+
+
+class RecomputeWorker(object):
+    """
+    background thread that recomputes ratings after games are committed
+
+    requests queued while a recompute is running are coalesced per kind, a burst
+    of submissions turns into one pass: new games are rated incrementally in
+    order, and deletes or edits replay once from the earliest point they touch
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self._cond = threading.Condition()
+        self._pending = {}
+        self._thread = None
+        self.running = False
+        self.last_duration = None
+        self.last_finished = None
+        self.last_error = None
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('RECOMPUTE_ASYNC', True)
+        app.config.setdefault('RECOMPUTE_RETRY_SECONDS', 5.)
+        app.extensions['recompute'] = self
+        self.app = app
+
+    def reset_after_fork(self):
+        'a forked child has no thread, and the jobs it inherited are left to the parent that queued them'
+        self._cond = threading.Condition()
+        self._pending = {}
+        self._thread = None
+        self.running = False
+
+    def submit(self, kind, game_id=None, since=None, full=False):
+        """
+        queues a recompute for kind ('singles' or 'doubles')
+        :param game_id: a newly recorded game, rated incrementally
+        :param since: (timestamp, game id) of a deleted or edited game to replay from
+        :param full: replay the whole history
+        """
+        with self._cond:
+            job = self._pending.setdefault(kind, {'games': [], 'since': None, 'full': False,
+                                                  'queued_at': time.time()})
+            if game_id is not None:
+                job['games'].append(game_id)
+            if since is not None:
+                job['since'] = min(job['since'] or since, tuple(since))
+            job['full'] = job['full'] or full
+
+            if self.app.config['RECOMPUTE_ASYNC']:
+                self._ensure_thread()
+                self._cond.notify()
+                return
+
+        self._run_pending()
+
+    def _ensure_thread(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._loop, name='ratings-recompute')
+            self._thread.daemon = True
+            self._thread.start()
+
+    def _loop(self):
+        while True:
+            with self._cond:
+                while not self._pending:
+                    self._cond.wait()
+            if not self._run_pending():
+                # the failed jobs are queued again, don't spin on an error that hasn't cleared
+                time.sleep(self.app.config['RECOMPUTE_RETRY_SECONDS'])
+
+    def _run_pending(self):
+        'runs the queued jobs, returns False when one failed and was queued again'
+        with self._cond:
+            pending, self._pending = self._pending, {}
+            self.running = True
+
+        start = time.time()
+        try:
+            with self.app.app_context():
+                for kind in list(pending):
+                    with timed('worker.recompute.%s' % kind):
+                        self._recompute(kind, pending[kind])
+                    del pending[kind]
+                with timed('worker.warm_ratings_state'):
+                    ratings_win_matrix(db.engine, rating_state(db.engine))
+            self.last_error = None
+            return True
+        except Exception as e:
+            self.last_error = repr(e)
+            self.app.logger.exception('ratings recompute failed')
+            self._requeue(pending)
+            return False
+        finally:
+            self.running = False
+            self.last_finished = time.time()
+            self.last_duration = self.last_finished - start
+
+    def _requeue(self, pending):
+        """
+        merges jobs that didn't finish back into the queue with anything submitted meanwhile.
+        the next pass skips games the failed one did rate, and replays from a game that
+        another process has since rated past
+        """
+        with self._cond:
+            for kind, job in pending.items():
+                queued = self._pending.get(kind)
+                if queued is not None:
+                    job['games'] = job['games'] + [g for g in queued['games'] if g not in job['games']]
+                    since = [p for p in (job['since'], queued['since']) if p is not None]
+                    job['since'] = min(since) if since else None
+                    job['full'] = job['full'] or queued['full']
+                self._pending[kind] = job
+
+    def _recompute(self, kind, job):
+        table, push = KINDS[kind]
+        con = db.engine
+
+        if job['full']:
+            push(con=con)
+            return
+
+        if job['since'] is not None:
+            # new games in the same burst come after the replay point and are picked up by the replay
+            push(con=con, since=job['since'])
+            return
+
+        params = dict(('g%d' % n, g) for n, g in enumerate(job['games']))
+        s = ('select * from {table} where deleted = 0 and id in ({ids}) '
+             'order by coalesce(timestamp, 0), id').format(table=table, ids=', '.join(':' + p for p in params))
+
+        with con.connect() as conn:
+            games = conn.execute(text(s), params).fetchall()
+
+        for game in games:
+            push(con=con, game=game)
+
+    def status(self):
+        with self._cond:
+            queued = [job['queued_at'] for job in self._pending.values()]
+            pending = dict((kind, len(job['games'])) for kind, job in self._pending.items())
+
+        now = time.time()
+        with db.engine.connect() as conn:
+            row = conn.execute(text('select version, timestamp from ratings_version where id = 1')).fetchone()
+        version, published = (row[0], row[1]) if row is not None else (0, None)
+
+        return {'ratings_version': version,
+                'published_at': published,
+                'seconds_since_publish': now - published if published else None,
+                'pending': pending,
+                'lag': now - min(queued) if queued else 0,
+                'running': self.running,
+                'last_duration': self.last_duration,
+                'last_error': self.last_error}
+
+
+recompute = RecomputeWorker()
@@ -0,0 +1,62 @@
+"""
+seeded synthetic league, players with a hidden skill play singles and doubles
+games whose results follow that skill, written through the app's models
+"""
+import random
+import time
+
+from app.model import DoublesGame, Game, Player, assign_player_ids, db
+
+
+def _loser_score(rng):
+    return rng.choice(range(0, 20))
+
+
+def _play(rng, skill_a, skill_b, noise=8.):
+    'scores for a game to 21 where the side with the higher noisy skill wins'
+    if skill_a + rng.gauss(0, noise) >= skill_b + rng.gauss(0, noise):
+        return 21, _loser_score(rng)
+    return _loser_score(rng), 21
+
+
+def generate_league(players=40, games=5000, doubles_share=0.2, days=365, seed=0, end=None):
+    """
+    fills the current app's database with a league, needs an app context
+    :param players: number of registered players
+    :param games: total number of games, singles and doubles
+    :param doubles_share: fraction of games that are doubles
+    :param days: the games are spread evenly at random over this many days before end
+    :return: list of the generated aliases
+    """
+    rng = random.Random(seed)
+    end = end or time.time()
+
+    aliases = ['player%03d' % n for n in range(players)]
+    skill = {alias: rng.gauss(25, 8) for alias in aliases}
+    db.session.bulk_save_objects([Player(alias=a, first_name=a.capitalize(), last_name='Synthetic')
+                                  for a in aliases])
+
+    timestamps = sorted(end - rng.random() * days * 86400 for _ in range(games))
+    records = []
+    for timestamp in timestamps:
+        if rng.random() < doubles_share:
+            a1, a2, b1, b2 = rng.sample(aliases, 4)
+            score_a, score_b = _play(rng, skill[a1] + skill[a2], skill[b1] + skill[b2])
+            records.append(DoublesGame(player_a_team_a=a1, player_b_team_a=a2, player_a_team_b=b1,
+                                       player_b_team_b=b2, score_team_a=score_a, score_team_b=score_b,
+                                       deleted=0, timestamp=timestamp))
+        else:
+            a, b = rng.sample(aliases, 2)
+            score_a, score_b = _play(rng, skill[a], skill[b])
+            records.append(Game(player_a=a, player_b=b, score_a=score_a, score_b=score_b,
+                                deleted=0, timestamp=timestamp))
+
+    db.session.bulk_save_objects(records)
+    db.session.commit()
+
+    # bulk saves skip the mapper events that resolve player ids
+    with db.engine.begin() as conn:
+        assign_player_ids(conn, 'game')
+        assign_player_ids(conn, 'doubles_game')
+
+    return aliases
@@ -0,0 +1,206 @@
+"""
+concurrent write load against one sqlite database, the way several gunicorn
+workers share it: each process builds its own app and for a while records
+games through /api/events, bulk imports through /api/import, reads the game
+log and ratings, and now and then replays the whole history. reports
+throughput, latencies and every error, 'database is locked' ones counted
+apart, then checks the published ratings against a fresh full replay
+
+    python benchmarks/locking.py --processes 4 --seconds 20
+
+exits with status 1 when any request failed or the ratings drifted
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from league import generate_league  # noqa: E402
+
+from app import create_app  # noqa: E402
+from app.config import Config  # noqa: E402
+
+# operation -> relative frequency
+MIX = {'event': 10, 'import': 2, 'read_games': 5, 'read_ratings': 5, 'replay': 1}
+
+IMPORT_ROWS = 20
+
+# published ratings may differ from a replay by the float error of incremental updates
+DRIFT_TOLERANCE = 1e-6
+
+
+def _config(path):
+    return type('LockingConfig', (Config,), {
+        'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + path,
+        'CACHE_TYPE': 'app.cache.lru',
+        'RECOMPUTE_ASYNC': False,
+        'TESTING': True,
+    })
+
+
+def _percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))] if values else None
+
+
+def worker(n, path, aliases, seconds, seed, results):
+    'runs the operation mix until seconds have passed, puts per-operation latencies and errors on results'
+    from app.model import db
+    from app.ratings import push_new_ratings
+
+    app = create_app(_config(path))
+    client = app.test_client()
+    rng = random.Random(seed + n)
+    operations = [op for op, weight in sorted(MIX.items()) for _ in range(weight)]
+
+    counter = [0]
+
+    def event():
+        counter[0] += 1
+        a, b = rng.sample(aliases, 2)
+        response = client.post('/api/events', json=[{
+            'event_id': 'locking-%d-%d' % (n, counter[0]), 'match_id': 'locking-%d-%d' % (n, counter[0]),
+            'type': 'final', 'player_a': a, 'player_b': b, 'score_a': 21, 'score_b': rng.randint(0, 19)}])
+        return response.status_code == 202, response.get_data(as_text=True)
+
+    def import_():
+        rows = ['player_a,score_a,player_b,score_b']
+        for _ in range(IMPORT_ROWS):
+            a, b = rng.sample(aliases, 2)
+            rows.append('%s,21,%s,%d' % (a, b, rng.randint(0, 19)))
+        response = client.post('/api/import', data='\n'.join(rows), content_type='text/csv')
+        return response.status_code == 200, response.get_data(as_text=True)
+
+    def read_games():
+        response = client.get('/api/games?length=25&start=%d' % rng.randint(0, 500))
+        return response.status_code == 200, response.get_data(as_text=True)
+
+    def read_ratings():
+        response = client.get('/api/ratings/distribution')
+        return response.status_code in (200, 304), response.get_data(as_text=True)
+
+    def replay():
+        with app.app_context():
+            push_new_ratings(con=db.engine)
+        return True, ''
+
+    run = {'event': event, 'import': import_, 'read_games': read_games, 'read_ratings': read_ratings,
+           'replay': replay}
+    report = dict((op, {'seconds': [], 'errors': []}) for op in MIX)
+
+    end = time.time() + seconds
+    while time.time() < end:
+        op = rng.choice(operations)
+        start = time.time()
+        try:
+            ok, body = run[op]()
+        except Exception as e:
+            ok, body = False, repr(e)
+        report[op]['seconds'].append(time.time() - start)
+        if not ok:
+            report[op]['errors'].append(body[:500])
+
+    results.put((n, report))
+
+
+def run(processes, seconds, players, games, seed):
+    from sqlalchemy import text
+
+    from app.headtohead import rebuild_head_to_head
+    from app.model import db
+    from app.ratings import push_new_doubles_ratings, push_new_ratings
+
+    handle, path = tempfile.mkstemp(suffix='.db')
+    os.close(handle)
+
+    try:
+        app = create_app(_config(path))
+        with app.app_context():
+            aliases = generate_league(players, games, 0.2, 365, seed)
+            push_new_ratings(con=db.engine)
+            push_new_doubles_ratings(con=db.engine)
+            with db.engine.begin() as conn:
+                rebuild_head_to_head(conn)
+                generated = conn.execute(text('select count(*) from game where deleted = 0')).scalar()
+            db.engine.dispose()
+
+        results = multiprocessing.Queue()
+        workers = [multiprocessing.Process(target=worker, args=(n, path, aliases, seconds, seed, results))
+                   for n in range(processes)]
+        start = time.time()
+        for p in workers:
+            p.start()
+        reports = [results.get() for _ in workers]
+        for p in workers:
+            p.join()
+        elapsed = time.time() - start
+
+        operations = {}
+        for op in MIX:
+            times = [t for _, report in reports for t in report[op]['seconds']]
+            errors = [e for _, report in reports for e in report[op]['errors']]
+            operations[op] = {'count': len(times), 'per_second': len(times) / elapsed,
+                              'p50': _percentile(times, 0.5), 'p99': _percentile(times, 0.99),
+                              'max': max(times) if times else None, 'errors': len(errors),
+                              'locked': sum(1 for e in errors if 'database is locked' in e),
+                              'first_error': errors[0] if errors else None}
+
+        with app.app_context():
+            s = 'select alias, rating, sigma from ratings'
+            with db.engine.connect() as conn:
+                published = dict((row[0], row[1:]) for row in conn.execute(text(s)))
+                recorded = conn.execute(text('select count(*) from game where deleted = 0')).scalar()
+            push_new_ratings(con=db.engine)
+            with db.engine.connect() as conn:
+                replayed = dict((row[0], row[1:]) for row in conn.execute(text(s)))
+            db.engine.dispose()
+
+        drift = max([abs(a - b) for key in replayed for a, b in zip(published.get(key, (0, 0)), replayed[key])]
+                    or [0.])
+    finally:
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+
+    return {'seconds': elapsed,
+            'games_recorded': recorded - generated,
+            'operations': operations,
+            'errors': sum(o['errors'] for o in operations.values()),
+            'locked': sum(o['locked'] for o in operations.values()),
+            'ratings_drift': drift}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--processes', type=int, default=4)
+    parser.add_argument('--seconds', type=float, default=20)
+    parser.add_argument('--players', type=int, default=40)
+    parser.add_argument('--games', type=int, default=2000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='json file to write, stdout by default')
+    args = parser.parse_args()
+
+    params = {'processes': args.processes, 'seconds': args.seconds, 'players': args.players,
+              'games': args.games, 'seed': args.seed}
+    report = {'created': time.time(), 'python': sys.version.split()[0], 'params': params,
+              'results': run(**params)}
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+    else:
+        print(json.dumps(report, indent=2, sort_keys=True))
+
+    results = report['results']
+    if results['errors'] or results['ratings_drift'] > DRIFT_TOLERANCE:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
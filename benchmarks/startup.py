@@ -0,0 +1,62 @@
+"""
+measures how long importing the app entry point takes (wsgi.py, or run.py in trees
+from before it existed) and how much memory the process holds afterwards, each
+sample in a fresh interpreter against an empty temporary database
+
+    python benchmarks/startup.py                      # this tree
+    git worktree add /tmp/pongr-before <rev>
+    python benchmarks/startup.py /tmp/pongr-before .  # before and after
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+HEAVY_MODULES = ['numpy', 'pandas', 'scipy', 'matplotlib', 'plotly', 'flask_admin', 'pandas_highcharts']
+
+CHILD = '''
+import json, os, resource, sys, time
+sys.path.insert(0, os.getcwd())
+start = time.time()
+__import__('wsgi' if os.path.exists('wsgi.py') else 'run')
+elapsed = time.time() - start
+rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+if sys.platform != 'darwin':
+    rss *= 1024
+print(json.dumps({'import_seconds': elapsed, 'max_rss_mb': rss / 2. ** 20,
+                  'loaded': [m for m in %r if m in sys.modules]}))
+''' % (HEAVY_MODULES,)
+
+
+def sample(tree):
+    with tempfile.NamedTemporaryFile(suffix='.db') as db:
+        env = dict(os.environ, PONGR_DATABASE_URI='sqlite:///' + db.name)
+        env.pop('PONGR_DEBUG', None)
+        out = subprocess.check_output([sys.executable, '-c', CHILD], cwd=tree, env=env)
+    return json.loads(out.decode('utf-8').strip().splitlines()[-1])
+
+
+def measure(tree, repeat):
+    samples = [sample(tree) for _ in range(repeat)]
+    times = sorted(s['import_seconds'] for s in samples)
+    rss = sorted(s['max_rss_mb'] for s in samples)
+    return {'tree': os.path.abspath(tree),
+            'import_seconds_median': times[len(times) // 2],
+            'import_seconds_min': times[0],
+            'max_rss_mb_median': rss[len(rss) // 2],
+            'loaded_heavy_modules': samples[-1]['loaded']}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('trees', nargs='*', default=[os.path.join(os.path.dirname(__file__), '..')])
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    print(json.dumps([measure(tree, args.repeat) for tree in args.trees], indent=2))
+
+
+if __name__ == '__main__':
+    main()
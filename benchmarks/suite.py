@@ -0,0 +1,153 @@
+"""
+times the rating engine, charts and pages against a synthetic league in a
+temporary sqlite database and writes the results as json
+
+    python benchmarks/suite.py --players 40 --games 5000 --output before.json
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from league import generate_league  # noqa: E402
+
+from app import create_app  # noqa: E402
+from app.config import Config  # noqa: E402
+
+
+def timeit(f, repeat):
+    'runs f repeat times, returns timing stats in seconds'
+    times = []
+    for _ in range(repeat):
+        start = time.time()
+        f()
+        times.append(time.time() - start)
+    times.sort()
+    return {'median': times[len(times) // 2], 'min': times[0], 'max': times[-1], 'repeat': repeat}
+
+
+def _commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       stderr=subprocess.STDOUT).decode('ascii').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(players, games, doubles_share, days, seed, repeat):
+    import pandas as pd
+
+    from app import plots
+    from app.cache import cache
+    from app.headtohead import rebuild_head_to_head
+    from app.model import db
+    from app.ratings import (calculate_ratings, calculate_doubles_ratings, calculate_team_ratings,
+                             push_new_ratings, push_new_doubles_ratings, win_probability_matrix, _read_games)
+    from app.state import clear_rating_state, rating_state
+
+    handle, path = tempfile.mkstemp(suffix='.db')
+    os.close(handle)
+
+    config = type('BenchmarkConfig', (Config,), {
+        'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + path,
+        'CACHE_TYPE': 'app.cache.lru',
+        'RECOMPUTE_ASYNC': False,
+    })
+
+    results = {}
+    try:
+        app = create_app(config)
+        client = app.test_client()
+
+        with app.app_context():
+            start = time.time()
+            aliases = generate_league(players, games, doubles_share, days, seed)
+            results['generate'] = {'seconds': time.time() - start}
+
+            with db.engine.connect() as conn:
+                singles = _read_games(conn, 'game')
+                doubles = _read_games(conn, 'doubles_game')
+
+            results['calculate_ratings'] = timeit(lambda: calculate_ratings(singles.copy()), repeat)
+            results['calculate_doubles_ratings'] = timeit(lambda: calculate_doubles_ratings(doubles.copy()), repeat)
+            results['calculate_team_ratings'] = timeit(lambda: calculate_team_ratings(doubles.copy()), repeat)
+
+            results['recompute_singles'] = timeit(lambda: push_new_ratings(con=db.engine), repeat)
+            results['recompute_doubles'] = timeit(lambda: push_new_doubles_ratings(con=db.engine), repeat)
+            with db.engine.begin() as conn:
+                rebuild_head_to_head(conn)
+
+            with db.engine.connect() as conn:
+                rating_df = pd.read_sql('select * from ratings left join player using (alias)', con=conn)
+
+            results['win_probability_matrix'] = timeit(
+                lambda: win_probability_matrix(rating_df['rating'].values, rating_df['sigma'].values), repeat)
+            results['rating_state_load'] = timeit(lambda: (clear_rating_state(), rating_state(db.engine)), repeat)
+            results['chart_rating_distribution'] = timeit(
+                lambda: plots.rating_distribution(rating_state(db.engine)), repeat)
+            results['chart_win_matrix'] = timeit(lambda: plots.win_matrix(db.engine, rating_state(db.engine)), repeat)
+
+        def get(url):
+            response = client.get(url)
+            assert response.status_code == 200, (url, response.status_code)
+
+        def ratings_cold():
+            with app.app_context():
+                cache.clear()
+            clear_rating_state()
+            get('/ratings')
+
+        n = [0]
+
+        def ingest():
+            n[0] += 1
+            a, b = aliases[n[0] % len(aliases)], aliases[(n[0] + 1) % len(aliases)]
+            response = client.post('/record_match', data={'player_a': a, 'player_b': b,
+                                                          'score_a': 21, 'score_b': 15})
+            assert response.status_code == 302, response.status_code
+
+        results['ingest_single_game'] = timeit(ingest, repeat)
+        results['page_games'] = timeit(lambda: get('/games'), repeat)
+        results['api_games_first_page'] = timeit(lambda: get('/api/games?length=25'), repeat)
+        results['api_games_deep_offset'] = timeit(lambda: get('/api/games?length=25&start=%d' % (games // 2)), repeat)
+        results['page_ratings_cold'] = timeit(ratings_cold, repeat)
+        results['page_ratings_warm'] = timeit(lambda: get('/ratings'), repeat)
+        results['api_ratings_distribution'] = timeit(lambda: get('/api/ratings/distribution'), repeat)
+        results['api_ratings_win_matrix'] = timeit(lambda: get('/api/ratings/win_matrix'), repeat)
+        results['page_player'] = timeit(lambda: get('/player/%s' % aliases[0]), repeat)
+    finally:
+        os.remove(path)
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--players', type=int, default=40)
+    parser.add_argument('--games', type=int, default=5000)
+    parser.add_argument('--doubles-share', type=float, default=0.2)
+    parser.add_argument('--days', type=int, default=365)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--output', help='json file to write, stdout by default')
+    args = parser.parse_args()
+
+    params = {'players': args.players, 'games': args.games, 'doubles_share': args.doubles_share,
+              'days': args.days, 'seed': args.seed, 'repeat': args.repeat}
+    report = {'commit': _commit(), 'created': time.time(), 'python': sys.version.split()[0],
+              'params': params, 'results': run(**params)}
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+    else:
+        print(json.dumps(report, indent=2, sort_keys=True))
+
+
+if __name__ == '__main__':
+    main()
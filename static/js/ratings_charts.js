@@ -0,0 +1,106 @@
+// draws the /ratings charts from the compact json payloads, needs jquery and plotly.js
+
+function normpdf(x, mu, sigma) {
+  return Math.exp(-0.5 * Math.pow((x - mu) / sigma, 2)) / (Math.sqrt(2 * Math.PI) * sigma);
+}
+
+function linspace(start, stop, n) {
+  var xs = [];
+  for (var i = 0; i < n; i++) {
+    xs.push(start + (stop - start) * i / (n - 1));
+  }
+  return xs;
+}
+
+function drawDistribution(element, data) {
+  var x = linspace(0, 50, 500);
+
+  var traces = data.mu.map(function (mu, n) {
+    return {
+      x: x,
+      y: x.map(function (v) { return normpdf(v, mu, data.sigma[n]); }),
+      name: data.name[n],
+      type: 'scatter'
+    };
+  });
+
+  var layout = {
+    title: 'Individual Gaussian Skill Distribution',
+    xaxis: {title: 'Mu'},
+    yaxis: {title: 'Value'},
+    height: 750
+  };
+
+  Plotly.newPlot(element, traces, layout);
+}
+
+function drawWinMatrix(element, data) {
+  var labels = data.players;
+  var index = {};
+  labels.forEach(function (p, n) { index[p] = n; });
+
+  var heatmap = {
+    z: data.matrix,
+    x: labels,
+    y: labels,
+    type: 'heatmap',
+    colorscale: 'Viridis',
+    zmin: 0,
+    zmax: 1
+  };
+
+  // pairs that have played, colored by the observed win rate and sized by the number of games
+  var observed = {x: [], y: [], text: [], color: [], size: []};
+  labels.forEach(function (winner, i) {
+    labels.forEach(function (loser, j) {
+      var games = data.games[i][j];
+      if (!games) {
+        return;
+      }
+      var wins = data.wins[i][j];
+      observed.x.push(loser);
+      observed.y.push(winner);
+      observed.color.push(wins / games);
+      observed.size.push(6 + 14 * Math.min(games, 20) / 20);
+      observed.text.push(winner + ' beat ' + loser + ' ' + wins + ' of ' + games +
+                         ' (predicted ' + Math.round(100 * data.matrix[i][j]) + '%)');
+    });
+  });
+
+  var scatter = {
+    x: observed.x,
+    y: observed.y,
+    text: observed.text,
+    hoverinfo: 'text',
+    mode: 'markers',
+    type: 'scatter',
+    name: 'Observed',
+    marker: {
+      color: observed.color,
+      colorscale: 'Viridis',
+      cmin: 0,
+      cmax: 1,
+      size: observed.size,
+      line: {color: 'white', width: 1}
+    }
+  };
+
+  var layout = {
+    title: 'Win Probability Matrix',
+    xaxis: {title: 'Loser', ticks: ''},
+    yaxis: {title: 'Winner', ticks: ''},
+    height: 750
+  };
+
+  Plotly.newPlot(element, [heatmap, scatter], layout);
+}
+
+$(document).ready(function () {
+  // both endpoints are etagged by ratings version, an unchanged chart revalidates with a 304
+  $.getJSON('/api/ratings/distribution', function (data) {
+    drawDistribution('dist-chart', data);
+  });
+  $.getJSON('/api/ratings/win_matrix', function (data) {
+    drawWinMatrix('matrix-chart', data);
+  });
+});
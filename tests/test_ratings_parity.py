@@ -0,0 +1,126 @@
+import random
+
+import pandas as pd
+import pytest
+from trueskill import Rating, TrueSkill, rate_1vs1
+
+from app.ratings import calculate_doubles_ratings, calculate_ratings
+
+TOLERANCE = 1e-6
+
+# trueskill's own erfc is an approximation good to about 1e-7 a game, which adds up to
+# more than the tolerance over a few hundred games. app.ratings uses math.erfc, so the
+# reference runs on trueskill's exact scipy backend
+BACKEND = 'scipy'
+
+PLAYERS = ['player%02d' % n for n in range(12)]
+
+
+def _score(rng, draws):
+    'a (score_a, score_b) pair, level about every draws-th game'
+    if rng.random() < 1. / draws:
+        score = rng.randint(0, 21)
+        return score, score
+    loser = rng.randint(0, 19)
+    return (21, loser) if rng.random() < 0.5 else (loser, 21)
+
+
+def singles_games(n_games, seed=0, draws=5):
+    rng = random.Random(seed)
+    rows = []
+    for n in range(n_games):
+        player_a, player_b = rng.sample(PLAYERS, 2)
+        score_a, score_b = _score(rng, draws)
+        rows.append({'id': n + 1, 'timestamp': 1000. + n, 'player_a': player_a, 'player_b': player_b,
+                     'score_a': score_a, 'score_b': score_b})
+    return pd.DataFrame(rows)
+
+
+def doubles_games(n_games, seed=0, draws=5):
+    rng = random.Random(seed)
+    rows = []
+    for n in range(n_games):
+        a1, a2, b1, b2 = rng.sample(PLAYERS, 4)
+        score_a, score_b = _score(rng, draws)
+        rows.append({'id': n + 1, 'timestamp': 1000. + n, 'player_a_team_a': a1, 'player_b_team_a': a2,
+                     'player_a_team_b': b1, 'player_b_team_b': b2, 'score_team_a': score_a, 'score_team_b': score_b})
+    return pd.DataFrame(rows)
+
+
+def reference_singles(games, env=None):
+    'the games rated one at a time by trueskill itself'
+    env = env or TrueSkill(backend=BACKEND)
+    ratings = {}
+    for game in games.itertuples(index=False):
+        a, b = ratings.get(game.player_a, env.create_rating()), ratings.get(game.player_b, env.create_rating())
+        if game.score_a >= game.score_b:
+            a, b = rate_1vs1(a, b, drawn=game.score_a == game.score_b, env=env)
+        else:
+            b, a = rate_1vs1(b, a, env=env)
+        ratings[game.player_a], ratings[game.player_b] = a, b
+    return ratings
+
+
+def reference_doubles(games, env=None):
+    env = env or TrueSkill(backend=BACKEND)
+    ratings = {}
+    for game in games.itertuples(index=False):
+        teams = [(game.player_a_team_a, game.player_b_team_a), (game.player_a_team_b, game.player_b_team_b)]
+        # lower rank wins, equal ranks draw
+        ranks = [int(game.score_team_a < game.score_team_b), int(game.score_team_a > game.score_team_b)]
+        rated = env.rate([tuple(ratings.get(p, env.create_rating()) for p in team) for team in teams], ranks=ranks)
+        for team, team_ratings in zip(teams, rated):
+            ratings.update(zip(team, team_ratings))
+    return ratings
+
+
+def assert_parity(actual, expected):
+    assert sorted(actual) == sorted(expected)
+    for key, rating in expected.items():
+        assert actual[key].mu == pytest.approx(rating.mu, abs=TOLERANCE), key
+        assert actual[key].sigma == pytest.approx(rating.sigma, abs=TOLERANCE), key
+
+
+@pytest.mark.parametrize('seed', [0, 1, 2])
+def test_singles_match_rate_1vs1(seed):
+    games = singles_games(300, seed=seed)
+    assert (games.score_a == games.score_b).any()
+
+    assert_parity(calculate_ratings(games, return_type='dict'), reference_singles(games))
+
+
+@pytest.mark.parametrize('seed', [0, 1, 2])
+def test_doubles_match_rate(seed):
+    games = doubles_games(300, seed=seed)
+    assert (games.score_team_a == games.score_team_b).any()
+
+    assert_parity(calculate_doubles_ratings(games, return_type='dict'), reference_doubles(games))
+
+
+def test_draws_only():
+    'a history of nothing but draws exercises the draw update alone'
+    games = singles_games(100, draws=1)
+    assert_parity(calculate_ratings(games, return_type='dict'), reference_singles(games))
+
+    games = doubles_games(100, draws=1)
+    assert_parity(calculate_doubles_ratings(games, return_type='dict'), reference_doubles(games))
+
+
+def test_custom_environment():
+    env = TrueSkill(mu=30., sigma=6., beta=5., tau=0.1, draw_probability=0.2, backend=BACKEND)
+
+    games = singles_games(200, seed=3)
+    assert_parity(calculate_ratings(games, rating_object=env.create_rating(), return_type='dict', env=env),
+                  reference_singles(games, env))
+
+    games = doubles_games(200, seed=3)
+    assert_parity(calculate_doubles_ratings(games, rating_object=env.create_rating(), return_type='dict', env=env),
+                  reference_doubles(games, env))
+
+
+def test_dataframe_matches_dict():
+    games = singles_games(100)
+    frame = calculate_ratings(games)
+    ratings = calculate_ratings(games, return_type='dict')
+
+    assert_parity({row['index']: Rating(row['rating'], row['sigma']) for _, row in frame.iterrows()}, ratings)
@@ -0,0 +1,86 @@
+import random
+
+import pytest
+from sqlalchemy import create_engine, text
+
+from app.model import db
+from app.ratings import SNAPSHOT_INTERVAL, push_new_doubles_ratings, push_new_ratings
+
+PLAYERS = ['player%02d' % n for n in range(10)]
+
+
+@pytest.fixture
+def engine(tmp_path):
+    engine = create_engine('sqlite:///%s' % tmp_path.joinpath('pong.db'))
+    db.metadata.create_all(engine)
+    yield engine
+    engine.dispose()
+
+
+def _ratings(engine, table='ratings', key='alias'):
+    with engine.connect() as conn:
+        s = 'select %s, rating, sigma from %s' % (key, table)
+        return {row[0]: (row[1], row[2]) for row in conn.execute(text(s))}
+
+
+def _assert_same(actual, expected):
+    assert sorted(actual) == sorted(expected)
+    for key, (mu, sigma) in expected.items():
+        assert actual[key] == pytest.approx((mu, sigma), abs=1e-9), key
+
+
+def _delete(engine, table, game_id):
+    'marks a game deleted and returns the (timestamp, id) point to replay from'
+    with engine.begin() as conn:
+        conn.execute(text('update %s set deleted = 1 where id = :id' % table), {'id': game_id})
+        return tuple(conn.execute(text('select timestamp, id from %s where id = :id' % table), {'id': game_id}).one())
+
+
+def test_singles_replay_after_delete_matches_full_replay(engine):
+    'a player whose only game comes after the snapshot a replay starts from is not resurrected by it'
+    rng = random.Random(0)
+    n_games = 2 * SNAPSHOT_INTERVAL + 50
+    newbie = n_games - 10
+
+    with engine.begin() as conn:
+        for n in range(1, n_games + 1):
+            a, b = ('newbie', PLAYERS[0]) if n == newbie else rng.sample(PLAYERS, 2)
+            conn.execute(text('insert into game (id, player_a, player_b, score_a, score_b, timestamp, deleted) '
+                              'values (:id, :a, :b, 21, :loser, :ts, 0)'),
+                         {'id': n, 'a': a, 'b': b, 'loser': rng.randint(0, 19), 'ts': 1000. + n})
+
+    push_new_ratings(con=engine)
+    assert 'newbie' in _ratings(engine)
+
+    push_new_ratings(con=engine, since=_delete(engine, 'game', newbie))
+    replayed = _ratings(engine)
+    assert 'newbie' not in replayed
+
+    push_new_ratings(con=engine)
+    _assert_same(replayed, _ratings(engine))
+
+
+def test_doubles_replay_after_delete_matches_full_replay(engine):
+    rng = random.Random(1)
+    n_games = 2 * SNAPSHOT_INTERVAL + 50
+    newbie = n_games - 10
+
+    with engine.begin() as conn:
+        for n in range(1, n_games + 1):
+            players = rng.sample(PLAYERS, 4)
+            if n == newbie:
+                players[0] = 'newbie'
+            conn.execute(text('insert into doubles_game (id, player_a_team_a, player_b_team_a, player_a_team_b, '
+                              'player_b_team_b, score_team_a, score_team_b, timestamp, deleted) '
+                              'values (:id, :a1, :a2, :b1, :b2, 21, :loser, :ts, 0)'),
+                         dict(zip(('a1', 'a2', 'b1', 'b2'), players), id=n, loser=rng.randint(0, 19), ts=1000. + n))
+
+    push_new_doubles_ratings(con=engine)
+    push_new_doubles_ratings(con=engine, since=_delete(engine, 'doubles_game', newbie))
+    replayed = _ratings(engine, 'doubles_ratings')
+    replayed_teams = _ratings(engine, 'team_doubles_ratings', 'team')
+    assert 'newbie' not in replayed
+
+    push_new_doubles_ratings(con=engine)
+    _assert_same(replayed, _ratings(engine, 'doubles_ratings'))
+    _assert_same(replayed_teams, _ratings(engine, 'team_doubles_ratings', 'team'))
@@ -0,0 +1,13 @@
+"""
+production entry point, configured from PONGR_* environment variables (see app/config.py)
+
+    gunicorn --workers 4 --preload wsgi:app
+    waitress-serve --port 8008 wsgi:app
+
+with --preload the schema migrations and backfills in create_app run once in the
+master instead of once per worker. a backfill replay create_app queues runs on in
+the master, forked workers start with fresh connection pools and no queued work
+"""
+from app import create_app
+
+app = application = create_app()